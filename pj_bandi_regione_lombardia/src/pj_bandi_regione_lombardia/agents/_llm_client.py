@@ -0,0 +1,130 @@
+# agents/_llm_client.py
+"""
+Client LLM condivisi a livello di processo.
+
+Ogni agente costruiva il proprio crewai.llm.LLM (e quindi il proprio client
+HTTP sottostante): in una pipeline che istanzia più agenti per richiesta,
+per le completion brevi il costo dominante diventa l'handshake TCP/TLS.
+Qui i client sono singleton memoizzati, con connection pooling e keep-alive,
+così tutte le chiamate riusano le stesse connessioni.
+"""
+import os
+from functools import lru_cache
+
+import httpx
+from crewai.llm import LLM
+from openai import AsyncAzureOpenAI, AzureOpenAI
+
+
+@lru_cache(maxsize=1)
+def _get_shared_http_client() -> httpx.AsyncClient:
+    """
+    Pool HTTP condiviso da tutti i client (litellm e SDK OpenAI): un solo
+    handshake TLS riusato tra gli agenti, con HTTP/2 se httpx ha l'extra h2
+    installato (multiplexing delle richieste concorrenti sulla stessa
+    connessione).
+    Returns:
+        httpx.AsyncClient: Client HTTP asincrono singleton
+    """
+    limits = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    try:
+        return httpx.AsyncClient(http2=True, limits=limits)
+    except ImportError:
+        # httpx senza l'extra h2: stesso pool, solo HTTP/1.1 keep-alive
+        return httpx.AsyncClient(limits=limits)
+
+
+@lru_cache(maxsize=1)
+def _get_shared_sync_http_client() -> httpx.Client:
+    """
+    Variante sincrona del pool condiviso, usata dalle chiamate bloccanti di
+    litellm (llm.call dei vari agenti).
+    Returns:
+        httpx.Client: Client HTTP sincrono singleton
+    """
+    limits = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    try:
+        return httpx.Client(http2=True, limits=limits)
+    except ImportError:
+        return httpx.Client(limits=limits)
+
+
+def warm_llm_connection():
+    """
+    Ping leggero all'endpoint Azure attraverso il pool sincrono condiviso:
+    tiene vive le connessioni keep-alive (e la sessione TLS) durante i tempi
+    morti, così il turno successivo di chat non ripaga l'handshake TCP/TLS.
+    Pensata per girare in background; qualunque errore è irrilevante.
+    """
+    base = os.getenv("AZURE_API_BASE")
+    if not base:
+        return
+    try:
+        _get_shared_sync_http_client().head(base, timeout=2.0)
+    except Exception:
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_llm(temperature: float = 0.7, max_tokens: int = 4000) -> LLM:
+    """
+    Restituisce l'istanza LLM condivisa per la configurazione richiesta.
+    Args:
+        temperature (float): Temperatura di generazione
+        max_tokens (int): Limite di token generati per chiamata
+    Returns:
+        LLM: Istanza crewai.llm.LLM riusata da tutti gli agenti
+    """
+    # crewai passa da litellm: agganciando il pool condiviso alla sessione
+    # asincrona di litellm anche le chiamate degli agenti riusano le
+    # connessioni invece di aprirne di nuove per ogni LLM
+    try:
+        import litellm
+        if getattr(litellm, "aclient_session", None) is None:
+            litellm.aclient_session = _get_shared_http_client()
+        if getattr(litellm, "client_session", None) is None:
+            litellm.client_session = _get_shared_sync_http_client()
+    except Exception:
+        pass
+
+    return LLM(
+        model=f"azure/{os.getenv('AZURE_LLM_MODEL')}",
+        api_key=os.getenv("AZURE_API_KEY"),
+        api_base=os.getenv("AZURE_API_BASE"),
+        api_version=os.getenv("AZURE_API_VERSION"),
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+
+
+@lru_cache(maxsize=1)
+def get_async_client() -> AsyncAzureOpenAI:
+    """
+    Client Azure OpenAI asincrono condiviso, con pool di connessioni
+    keep-alive e retry esponenziale integrato per 429/5xx transitori.
+    Returns:
+        AsyncAzureOpenAI: Client singleton per le chiamate concorrenti
+    """
+    return AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_API_BASE"),
+        api_version=os.getenv("AZURE_API_VERSION"),
+        max_retries=3,
+        http_client=_get_shared_http_client()
+    )
+
+
+@lru_cache(maxsize=1)
+def get_sync_client() -> AzureOpenAI:
+    """
+    Client Azure OpenAI sincrono condiviso, usato dove serve l'SDK diretto
+    (es. risposte in streaming token per token).
+    Returns:
+        AzureOpenAI: Client singleton con retry integrato
+    """
+    return AzureOpenAI(
+        api_key=os.getenv("AZURE_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_API_BASE"),
+        api_version=os.getenv("AZURE_API_VERSION"),
+        max_retries=3
+    )
@@ -1,61 +1,281 @@
 # agents/extractor_agent.py
 from crewai import Agent
-from crewai.llm import LLM
+from agents._llm_client import get_llm, get_sync_client
+import asyncio
+import hashlib
+import logging
 import os
 import json
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple
 
+# orjson è opzionale: parsing/serializzazione JSON 2-5x più veloci quando
+# presente, fallback trasparente alla stdlib altrimenti
+try:
+    import orjson
+    _HAS_ORJSON = True
+except ImportError:
+    _HAS_ORJSON = False
+
+# Logger di modulo al posto di print: sul percorso caldo dell'estrazione le
+# righe di traccia per campo sono a livello DEBUG, quindi gratis quando la
+# soglia è INFO, e le estrazioni concorrenti non si serializzano sul flush
+# sincrono di stdout
+logger = logging.getLogger(__name__)
+
+# Cache persistente ancorata alla cartella del pacchetto, non alla CWD:
+# avviare gli entrypoint da un'altra directory non deve ripartire a freddo
+# né disseminare file .sqlite3 in giro
+_PACKAGE_DIR = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _json_loads(text: str):
+    """json.loads, con orjson quando disponibile"""
+    if _HAS_ORJSON:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _json_dumps(obj) -> str:
+    """Serializzazione indentata non-ASCII, con orjson quando disponibile"""
+    if _HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+# Validazione date DD/MM/YYYY precompilata una volta a livello di modulo:
+# il vecchio lambda con split() allocava una lista per chiamata e accettava
+# anche date impossibili come "99/99/9999"
+_DATE_RE = re.compile(r'^(0[1-9]|[12]\d|3[01])/(0[1-9]|1[0-2])/\d{4}$')
+
+# Mesi italiani -> numero, per normalizzare deterministicamente le date testuali
+_MESI = {
+    "gennaio": "01", "febbraio": "02", "marzo": "03", "aprile": "04",
+    "maggio": "05", "giugno": "06", "luglio": "07", "agosto": "08",
+    "settembre": "09", "ottobre": "10", "novembre": "11", "dicembre": "12"
+}
+
+
+def _valid_date(value: str) -> bool:
+    """True se il valore è una data DD/MM/YYYY valida oppure 'Non specificato'"""
+    return value == "Non specificato" or _DATE_RE.match(value) is not None
+
+
+# Pattern deterministici per le date di apertura/chiusura nei testi dei bandi
+# ("a partire dal 28 marzo 2025", "entro il 30/04/2025", "ore 12:00 del 15 aprile"):
+# nel caso comune evitano del tutto il round-trip LLM di recupero date
+_MESE_ALT = "|".join(_MESI)
+_DATE_OPEN_RE = re.compile(
+    r'(?:a partire dal|apertura[^\d]{0,30}|dalle ore [\d:.]{1,8} del|dal giorno|presentazione (?:delle )?domande dal)'
+    r'\s*(\d{1,2})[\s/-](' + _MESE_ALT + r'|\d{1,2})(?:[\s/-](\d{4}))?',
+    re.IGNORECASE
+)
+_DATE_CLOSE_RE = re.compile(
+    r'(?:entro il|entro le ore [\d:.]{1,8} del|fino al|scadenza[^\d]{0,20}|termine ultimo[^\d]{0,20}|chiusura[^\d]{0,30})'
+    r'\s*(\d{1,2})[\s/-](' + _MESE_ALT + r'|\d{1,2})(?:[\s/-](\d{4}))?',
+    re.IGNORECASE
+)
+_YEAR_HINT_RE = re.compile(r'(?:campagna|bando|anno)\s+(\d{4})', re.IGNORECASE)
+
+
+def _infer_year(text: str) -> str:
+    """Deduce l'anno dal contesto (es. 'campagna 2025', 'bando 2025-2026'), None se assente"""
+    match = _YEAR_HINT_RE.search(text)
+    return match.group(1) if match else None
+
+
+def _normalize_date(day: str, month: str, year: str, text: str) -> str:
+    """Normalizza una data catturata in DD/MM/YYYY; None se non normalizzabile"""
+    month_key = month.lower()
+    if month_key in _MESI:
+        month = _MESI[month_key]
+    elif not month.isdigit():
+        return None
+    if not year:
+        year = _infer_year(text)
+        if not year:
+            return None
+    candidate = f"{int(day):02d}/{int(month):02d}/{year}"
+    return candidate if _DATE_RE.match(candidate) else None
+
+
+def _document_head(text: str, limit: int) -> str:
+    """
+    Primi `limit` caratteri del documento, tagliati se possibile sull'ultimo
+    separatore di pagina '--- PAGINA' invece che a metà frase: gli estratti
+    allineati alle pagine riducono le allucinazioni (e quindi i retry).
+    """
+    if len(text) <= limit:
+        return text
+    boundary = text.rfind('\n\n--- PAGINA', 0, limit)
+    # Taglia sulla pagina solo se non dimezza l'estratto
+    if boundary > limit // 2:
+        return text[:boundary]
+    return text[:limit]
+
+
+def _extract_dates_regex(text: str) -> Dict:
+    """
+    Estrazione deterministica delle date di apertura/chiusura dal testo.
+    Returns:
+        Dict con le chiavi 'Apertura' e/o 'Chiusura' trovate (in DD/MM/YYYY).
+    """
+    dates = {}
+    for field_name, pattern in (("Apertura", _DATE_OPEN_RE), ("Chiusura", _DATE_CLOSE_RE)):
+        match = pattern.search(text)
+        if match:
+            value = _normalize_date(match.group(1), match.group(2), match.group(3), text)
+            if value:
+                dates[field_name] = value
+    return dates
+
 class ExtractorAgent:
     def __init__(self):
-        # Configurazione LLM per estrazione precisa
-        self.llm = LLM(
-            model=f"azure/{os.getenv('AZURE_LLM_MODEL')}",
-            api_key=os.getenv("AZURE_API_KEY"),
-            api_base=os.getenv("AZURE_API_BASE"),
-            api_version=os.getenv("AZURE_API_VERSION"),
-            temperature=0.1,  # Bassa temperatura per maggiore precisione
-            max_tokens=4000
-        )
-        print("✅ ExtractorAgent LLM configurato")
-        
+        # LLM condiviso a livello di processo (bassa temperatura per precisione):
+        # riusa connessioni TCP/TLS invece di aprire un client per agente
+        self.llm = get_llm(temperature=0.1, max_tokens=4000)
+        logger.info("✅ ExtractorAgent LLM configurato")
+
+        # Cache di sessione: le query per campo sono costanti tra i documenti,
+        # quindi le risposte RAG e le chiamate LLM identiche vengono riusate
+        # invece di ripagare embedding + retrieval + generazione
+        self._rag_cache = {}
+        self._llm_cache = {}
+
+        # Secondo livello persistente per le chiamate LLM: con temperatura 0.1
+        # le risposte sono di fatto deterministiche, quindi sopravvivono ai
+        # riavvii in SQLite (con TTL) come la cache degli embedding in rag.py
+        self._llm_cache_path = str(_PACKAGE_DIR / "llm_cache.sqlite3")
+        self._llm_cache_conn = None
+        self._llm_cache_lock = threading.Lock()
+
+        # Embedding delle query costanti per campo, calcolati pigramente alla
+        # prima estrazione e riusati per tutti i documenti successivi
+        self._query_vecs = None
+
+    def _cached_generate(self, rag_system, query: str, k: int, source_file: str = ""):
+        """
+        Memoizza rag_system.generate per (query, k, source_file): le query per
+        campo sono costanti, quindi senza il documento nella chiave ogni bando
+        successivo riuserebbe il retrieval del primo.
+        """
+        cache_key = (query, k, source_file)
+        if cache_key not in self._rag_cache:
+            self._rag_cache[cache_key] = rag_system.generate(query, k=k)
+        return self._rag_cache[cache_key]
+
+    # TTL della cache persistente: oltre questa età la risposta viene rigenerata
+    _LLM_CACHE_TTL = 7 * 24 * 3600
+
+    def _llm_cache_connection(self):
+        """Apre (una volta) la connessione SQLite della cache LLM persistente"""
+        if self._llm_cache_conn is None:
+            self._llm_cache_conn = sqlite3.connect(self._llm_cache_path, check_same_thread=False)
+            self._llm_cache_conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response TEXT, created REAL)"
+            )
+        return self._llm_cache_conn
+
+    def _cached_llm_call(self, prompt: str, max_tokens: int = None,
+                         json_mode: bool = False) -> str:
+        """
+        Memoizza self.llm.call per hash di (modello, budget, modalità, prompt).
+        L1: dizionario in memoria per la sessione. L2: SQLite con TTL, così
+        ri-esecuzioni sullo stesso corpus saltano Azure anche tra processi
+        diversi (le chiamate a temperatura 0.1 sono di fatto deterministiche).
+        Con max_tokens usa l'istanza LLM condivisa con quel budget di output:
+        un tetto vicino alla lunghezza attesa della risposta riduce la latenza
+        di coda rispetto al default di 4000 token.
+        Con json_mode=True la chiamata passa dall'SDK diretto con
+        response_format json_object: il modello è vincolato a emettere JSON
+        valido, quindi niente retry per risposte con testo spurio attorno
+        all'oggetto (il prompt deve già chiedere esplicitamente JSON).
+        """
+        cache_id = f"{os.getenv('AZURE_LLM_MODEL')}\0{max_tokens}\0{json_mode}\0{prompt}"
+        key = hashlib.sha256(cache_id.encode("utf-8")).hexdigest()
+
+        if key in self._llm_cache:
+            logger.debug(f"   ✅ Cache LLM: HIT in memoria ({key[:8]})")
+            return self._llm_cache[key]
+
+        with self._llm_cache_lock:
+            connection = self._llm_cache_connection()
+            row = connection.execute(
+                "SELECT response, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is not None and time.time() - row[1] < self._LLM_CACHE_TTL:
+            logger.debug(f"   ✅ Cache LLM: HIT su disco ({key[:8]})")
+            self._llm_cache[key] = row[0]
+            return row[0]
+
+        logger.debug(f"   ⚠️ Cache LLM: MISS ({key[:8]})")
+        if json_mode:
+            completion = get_sync_client().chat.completions.create(
+                model=os.getenv("AZURE_LLM_MODEL"),
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.1,
+                max_tokens=max_tokens or 4000,
+                response_format={"type": "json_object"}
+            )
+            response = completion.choices[0].message.content
+        else:
+            llm = get_llm(temperature=0.1, max_tokens=max_tokens) if max_tokens else self.llm
+            response = llm.call(prompt)
+
+        self._llm_cache[key] = response
+        with self._llm_cache_lock:
+            connection = self._llm_cache_connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created) VALUES (?, ?, ?)",
+                (key, response, time.time()))
+            connection.commit()
+        return response
+
     def reconstruct_full_document(self, rag_system, source_file: str) -> str:
         """Ricostruisce il documento completo dai chunk nel vector store"""
         try:
-            print(f"🔍 Ricostruzione documento da: {os.path.basename(source_file)}")
+            logger.info(f"🔍 Ricostruzione documento da: {os.path.basename(source_file)}")
             
             # Usa il nuovo metodo per recuperare TUTTI i chunks del documento
             all_documents = rag_system.get_all_documents_by_source(source_file)
             
             if not all_documents:
-                print(f"❌ Nessun chunk trovato per il file: {source_file}")
+                logger.error(f"❌ Nessun chunk trovato per il file: {source_file}")
                 return ""
             
-            print(f"📊 Trovati {len(all_documents)} chunks totali per questo documento")
+            logger.info(f"📊 Trovati {len(all_documents)} chunks totali per questo documento")
             
             # Converti in formato con metadata
-            all_chunks = []
-            for doc in all_documents:
-                metadata = getattr(doc, 'metadata', {})
-                all_chunks.append({
+            all_chunks = [
+                {
                     'content': doc.page_content,
-                    'page': metadata.get('page', 0),
-                    'metadata': metadata
-                })
-            
+                    'page': getattr(doc, 'metadata', {}).get('page', 0)
+                }
+                for doc in all_documents
+            ]
+
             # Ordina per numero di pagina
             all_chunks.sort(key=lambda x: x['page'])
-            
-            # Ricostruisci il documento
-            full_document = ""
+
+            # Ricostruisci il documento: append su lista + join finale invece di
+            # += sulla stringa, che è O(n²) sui documenti multi-MB
+            parts = []
             current_page = -1
-            
+
             for chunk in all_chunks:
                 if chunk['page'] != current_page:
-                    full_document += f"\n\n--- PAGINA {chunk['page']} ---\n\n"
+                    parts.append(f"\n\n--- PAGINA {chunk['page']} ---\n\n")
                     current_page = chunk['page']
-                full_document += chunk['content'] + "\n"
+                parts.append(chunk['content'])
+                parts.append("\n")
+
+            full_document = "".join(parts)
             
-            print(f"✅ Documento ricostruito: {len(all_chunks)} chunks, {len(full_document)} caratteri totali")
+            logger.info(f"✅ Documento ricostruito: {len(all_chunks)} chunks, {len(full_document)} caratteri totali")
             
             # Verifica di completezza
             pages = set(chunk['page'] for chunk in all_chunks)
@@ -64,38 +284,132 @@ class ExtractorAgent:
                 max_page = max(pages)
                 missing_pages = set(range(min_page, max_page + 1)) - pages
                 if missing_pages:
-                    print(f"⚠️ Possibili pagine mancanti: {sorted(missing_pages)}")
+                    logger.warning(f"⚠️ Possibili pagine mancanti: {sorted(missing_pages)}")
             
             return full_document
             
         except Exception as e:
-            print(f"❌ Errore nella ricostruzione documento: {e}")
+            logger.error(f"❌ Errore nella ricostruzione documento: {e}")
             return ""
     
-    def extract_field_with_rag(self, rag_system, field_name: str, field_config: Dict) -> str:
+    def _warm_query_vectors(self, rag_system, field_configs: Dict) -> None:
+        """
+        Pre-embedda in un'unica chiamata le query costanti dei campi.
+        Le stesse sette query venivano ri-embeddate via Azure per ogni
+        documento: qui i vettori vengono calcolati una volta per sessione.
+        """
+        if self._query_vecs is not None or rag_system is None:
+            return
+        try:
+            queries = [cfg.get('query', name) for name, cfg in field_configs.items()]
+            vectors = rag_system.embeddings.embed_documents(queries)
+            self._query_vecs = dict(zip(queries, vectors))
+        except Exception as e:
+            logger.warning(f"⚠️ Warm-up embedding query fallito: {e}")
+            self._query_vecs = {}
+
+    def _field_contexts(self, rag_system, field_name: str, field_config: Dict,
+                        source_file: str = "") -> str:
+        """
+        Recupera i contesti per un campo: se il vettore della query è già
+        stato precalcolato, cerca direttamente per vettore (niente round-trip
+        embeddings né chiamata LLM intermedia di generate); altrimenti
+        fallback a generate con cache di sessione. Il filtro sui metadata
+        evita che i top-3 arrivino da altri bandi del corpus, che era la
+        prima causa di valori allucinati e quindi di retry in validazione.
+        """
+        query = field_config.get('query', field_name)
+        search_filter = {"source": source_file} if source_file else None
+        query_vector = (self._query_vecs or {}).get(query)
+        if query_vector is not None and rag_system.vector_store is not None:
+            documents = rag_system.vector_store.similarity_search_by_vector(
+                query_vector, k=3, filter=search_filter)
+            return "\n\n".join(doc.page_content for doc in documents)
+        if search_filter is not None and rag_system.vector_store is not None:
+            documents = rag_system.vector_store.similarity_search(
+                query, k=3, filter=search_filter)
+            return "\n\n".join(doc.page_content for doc in documents)
+        return self._cached_generate(rag_system, query, k=3, source_file=source_file).content
+
+    def _clean_and_validate(self, field_name: str, field_config: Dict, response: str) -> str:
+        """Ripulisce la risposta LLM e applica il validatore del campo, se presente"""
+        value = response.strip()
+        if 'validator' in field_config and not field_config['validator'](value):
+            logger.warning(f"⚠️ Valore non valido per {field_name}: {value}")
+            return "Non specificato"
+        return value
+
+    def extract_field_with_rag(self, rag_system, field_name: str, field_config: Dict,
+                               source_file: str = "") -> str:
         """
         Estrae un singolo campo usando il RAG system per ricerca mirata
-        
+
         Args:
             rag_system: Il sistema RAG per le ricerche
             field_name: Nome del campo da estrarre
             field_config: Configurazione con query e validazione per il campo
-        
+            source_file: Se indicato, limita la ricerca ai chunk di questo documento
+
         Returns:
             Il valore estratto o "Non specificato"
         """
         try:
-            # Usa il RAG per cercare informazioni specifiche
-            query = field_config.get('query', field_name)
-            rag_response = rag_system.generate(query, k=3)
-            
-            # Per le date, usa un prompt specializzato
-            if field_name in ["Apertura", "Chiusura"]:
-                extraction_prompt = f"""
+            contexts = self._field_contexts(rag_system, field_name, field_config, source_file)
+            extraction_prompt = self._build_field_prompt(field_name, field_config, contexts)
+
+            response = self._cached_llm_call(
+                extraction_prompt, max_tokens=field_config.get('max_tokens', 128))
+
+            return self._clean_and_validate(field_name, field_config, response)
+
+        except Exception as e:
+            logger.error(f"❌ Errore nell'estrazione RAG di {field_name}: {e}")
+            return "Non specificato"
+
+    async def aextract_all_fields(self, rag_system, field_configs: Dict, source_file: str = "",
+                                  concurrency: int = 8) -> Dict:
+        """
+        Estrae tutti i campi in parallelo con asyncio.gather dietro un
+        semaforo: il retrieval (sincrono) gira in thread, la chiamata LLM usa
+        acall. La latenza della fase scende a quella del campo più lento,
+        restando sotto il rate limit Azure grazie al tetto di concorrenza.
+
+        Args:
+            rag_system: Il sistema RAG per le ricerche
+            field_configs: Configurazione per campo (query, istruzioni, validatori)
+            source_file: Se indicato, limita le ricerche a questo documento
+            concurrency: Numero massimo di estrazioni in volo
+
+        Returns:
+            Dict campo -> valore estratto
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def extract_one(field_name, config):
+            async with semaphore:
+                try:
+                    contexts = await asyncio.to_thread(
+                        self._field_contexts, rag_system, field_name, config, source_file)
+                    prompt = self._build_field_prompt(field_name, config, contexts)
+                    response = await self.llm.acall(prompt)
+                    return field_name, self._clean_and_validate(field_name, config, response)
+                except Exception as e:
+                    logger.error(f"❌ Errore nell'estrazione RAG di {field_name}: {e}")
+                    return field_name, "Non specificato"
+
+        results = await asyncio.gather(
+            *(extract_one(name, config) for name, config in field_configs.items()))
+        return dict(results)
+
+    def _build_field_prompt(self, field_name: str, field_config: Dict, contexts: str) -> str:
+        """Costruisce il prompt di estrazione per un singolo campo"""
+        # Per le date, usa un prompt specializzato
+        if field_name in ["Apertura", "Chiusura"]:
+            return f"""
                 Dai seguenti contesti, estrai la data di {field_name.lower()} del bando.
                 
                 CONTESTI TROVATI:
-                {rag_response.content}
+                {contexts}
                 
                 ISTRUZIONI SPECIFICHE:
                 {field_config.get('instruction', f'Estrai il valore di {field_name}')}
@@ -114,13 +428,12 @@ class ExtractorAgent:
                 
                 Rispondi SOLO con la data nel formato DD/MM/YYYY. Se non trovi la data, rispondi "Non specificato".
                 """
-            else:
-                # Prompt standard per altri campi
-                extraction_prompt = f"""
+        # Prompt standard per altri campi
+        return f"""
                 Dai seguenti contesti, estrai SOLO il valore per "{field_name}".
                 
                 CONTESTI TROVATI:
-                {rag_response.content}
+                {contexts}
                 
                 ISTRUZIONI SPECIFICHE:
                 {field_config.get('instruction', f'Estrai il valore di {field_name}')}
@@ -133,24 +446,219 @@ class ExtractorAgent:
                 
                 Rispondi SOLO con il valore estratto. Se non trovi l'informazione, rispondi "Non specificato".
                 """
-            
-            response = self.llm.call(extraction_prompt)
-            
-            # Pulisci la risposta
-            value = response.strip()
-            
-            # Valida il formato se specificato
-            if 'validator' in field_config:
-                if not field_config['validator'](value):
-                    print(f"⚠️ Valore non valido per {field_name}: {value}")
-                    return "Non specificato"
-            
-            return value
-            
+
+    def _build_bulk_extraction_prompt(self, full_document: str, filename: str) -> str:
+        """
+        Costruisce il prompt multi-campo usato per l'estrazione bulk di un documento.
+        Il documento viene messo in testa al prompt: il prompt caching automatico
+        di Azure OpenAI deduplica i prefissi identici (≥1024 token), quindi le
+        chiamate successive sullo stesso documento ripagano solo le istruzioni.
+        """
+        return f"""
+        DOCUMENTO (estratto):
+        {_document_head(full_document, 8000)}
+
+        Analizza il documento di bando sopra ({filename}) ed estrai le informazioni richieste.
+
+        Rispondi SOLO con un oggetto JSON con ESATTAMENTE queste chiavi:
+        "Ente erogatore", "Titolo dell'avviso", "Descrizione aggiuntiva", "Beneficiari",
+        "Apertura", "Chiusura", "Dotazione finanziaria", "Contributo", "Parole chiave".
+
+        Date in formato DD/MM/YYYY, importi con il simbolo €.
+        Per i campi non trovati usa "Non specificato". Nessuna spiegazione.
+        """
+
+    def submit_batch(self, rag_system, source_files: List[str], completion_window: str = "24h",
+                     poll_interval: int = 60) -> Dict:
+        """
+        Estrazione bulk di molti bandi tramite Azure OpenAI Batch API.
+        Adatta ai run notturni non interattivi: le richieste vengono serializzate
+        in un file JSONL (una chat completion per documento, custom_id = nome file),
+        inviate come batch con finestra di completamento a 24h (~50% di costo in
+        meno rispetto alle richieste sincrone) e i risultati vengono riscaricati
+        e riassociati per custom_id.
+
+        Args:
+            rag_system: Sistema RAG con il vector store dei documenti
+            source_files: Path sorgente dei documenti da estrarre
+            completion_window: Finestra di completamento del batch (default "24h")
+            poll_interval: Secondi tra un polling e l'altro dello stato del batch
+
+        Returns:
+            Dict nome_file -> dati estratti (dict), vuoto in caso di errore.
+        """
+        import io
+        import time
+        from openai import AzureOpenAI
+
+        client = AzureOpenAI(
+            api_key=os.getenv("AZURE_API_KEY"),
+            azure_endpoint=os.getenv("AZURE_API_BASE"),
+            api_version=os.getenv("AZURE_API_VERSION")
+        )
+
+        # Serializza una richiesta JSONL per documento
+        request_lines = []
+        for source_file in source_files:
+            filename = os.path.basename(source_file)
+            full_document = self.reconstruct_full_document(rag_system, source_file)
+            if not full_document:
+                logger.warning(f"⚠️ Documento vuoto, saltato: {filename}")
+                continue
+            request_lines.append(json.dumps({
+                "custom_id": filename,
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": {
+                    "model": os.getenv("AZURE_LLM_MODEL"),
+                    "messages": [
+                        {"role": "user", "content": self._build_bulk_extraction_prompt(full_document, filename)}
+                    ],
+                    "temperature": 0.1,
+                    "max_tokens": 4000,
+                    "response_format": {"type": "json_object"}
+                }
+            }, ensure_ascii=False))
+
+        if not request_lines:
+            logger.error("❌ Nessuna richiesta da inviare al batch")
+            return {}
+
+        try:
+            batch_file = client.files.create(
+                file=io.BytesIO("\n".join(request_lines).encode("utf-8")),
+                purpose="batch"
+            )
+            batch = client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/chat/completions",
+                completion_window=completion_window
+            )
+            logger.info(f"📤 Batch inviato: {batch.id} ({len(request_lines)} documenti)")
+
+            # Polling fino a uno stato terminale
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(poll_interval)
+                batch = client.batches.retrieve(batch.id)
+                logger.debug(f"⏳ Stato batch: {batch.status}")
+
+            if batch.status != "completed":
+                logger.error(f"❌ Batch terminato con stato: {batch.status}")
+                return {}
+
+            # Scarica e riassocia i risultati per custom_id
+            results = {}
+            output_text = client.files.content(batch.output_file_id).text
+            for line in output_text.splitlines():
+                if not line.strip():
+                    continue
+                item = _json_loads(line)
+                content = item["response"]["body"]["choices"][0]["message"]["content"]
+                json_start = content.find('{')
+                json_end = content.rfind('}') + 1
+                try:
+                    results[item["custom_id"]] = _json_loads(content[json_start:json_end])
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"⚠️ Risposta non parsabile per {item.get('custom_id')}: {e}")
+
+            logger.info(f"✅ Batch completato: {len(results)}/{len(request_lines)} documenti estratti")
+            return results
+
         except Exception as e:
-            print(f"❌ Errore nell'estrazione RAG di {field_name}: {e}")
-            return "Non specificato"
-    
+            logger.error(f"❌ Errore nell'estrazione batch: {e}")
+            return {}
+
+    def extract_all_fields_batched(self, rag_system, field_configs: Dict,
+                                   full_document: str, source_file: str) -> Dict:
+        """
+        Estrae tutti i campi con UNA sola chiamata LLM invece di una per campo.
+        Esegue una ricerca che unisce le query per campo, FILTRATA sul
+        documento target: i top-k sull'intero corpus possono appartenere a un
+        altro bando, che qui significherebbe valori estratti dal documento
+        sbagliato. Il documento entra nel prompt, quindi anche le cache LLM
+        (in memoria e SQLite) restano distinte per documento.
+
+        Args:
+            rag_system: Il sistema RAG per le ricerche
+            field_configs: Configurazione per campo (query, istruzioni, validatori)
+            full_document: Documento completo ricostruito (contesto di riserva)
+            source_file: Path sorgente del documento, usato come filtro
+
+        Returns:
+            Dict campo -> valore estratto, oppure None se il JSON non è parsabile
+            (in quel caso il chiamante usa il fallback per campo).
+        """
+        try:
+            # Una sola ricerca che combina le query di tutti i campi, limitata
+            # ai chunk del documento target; senza filtro applicabile si usa
+            # direttamente la testa del documento ricostruito
+            combined_query = " ".join(
+                config.get('query', field_name) for field_name, config in field_configs.items()
+            )
+            contexts = ""
+            if source_file and rag_system.vector_store is not None:
+                documents = rag_system.vector_store.similarity_search(
+                    combined_query, k=5, filter={"source": source_file})
+                contexts = "\n\n".join(doc.page_content for doc in documents)
+            if not contexts:
+                contexts = "(nessuno)"
+
+            # Un solo prompt con istruzioni, formato ed esempi per ogni campo
+            field_sections = []
+            for field_name, config in field_configs.items():
+                field_sections.append(
+                    f'- "{field_name}": {config.get("instruction", f"Estrai il valore di {field_name}")} '
+                    f'(FORMATO: {config.get("format", "Testo semplice")}; ESEMPI: {config.get("examples", "N/A")})'
+                )
+            fields_block = "\n".join(field_sections)
+
+            # Il documento apre il prompt, byte-identico al prefisso dei
+            # prompt derivata/validazione dello stesso documento: il prompt
+            # caching di Azure (prefissi ≥1024 token) deduplica le chiamate,
+            # e il modello estrae dal bando giusto anche quando i contesti
+            # mirati sono scarsi
+            extraction_prompt = f"""
+        DOCUMENTO (estratto):
+        {_document_head(full_document, 5000)}
+
+        Dal documento sopra (e dai contesti mirati sotto), estrai il valore di OGNI campo elencato.
+
+        CONTESTI MIRATI (ricerca limitata al documento):
+        {contexts}
+
+        CAMPI DA ESTRARRE:
+        {fields_block}
+
+        IMPORTANTE per le date: formato DD/MM/YYYY, mesi italiani convertiti in numero,
+        anno dedotto dal contesto se mancante.
+
+        Rispondi SOLO con un oggetto JSON le cui chiavi sono ESATTAMENTE i nomi dei campi elencati.
+        Per i campi non trovati usa "Non specificato". Nessuna spiegazione.
+        """
+
+            # response_format json_object: l'output è garantito JSON, il
+            # ritaglio find/rfind resta solo come cintura di sicurezza
+            response = self._cached_llm_call(extraction_prompt, max_tokens=1024, json_mode=True)
+            json_start = response.find('{')
+            json_end = response.rfind('}') + 1
+            if json_start < 0 or json_end <= json_start:
+                return None
+            parsed = _json_loads(response[json_start:json_end])
+
+            # Validazione per campo come nel percorso originale
+            extracted = {}
+            for field_name, config in field_configs.items():
+                value = str(parsed.get(field_name, "Non specificato")).strip() or "Non specificato"
+                if 'validator' in config and not config['validator'](value):
+                    logger.warning(f"⚠️ Valore non valido per {field_name}: {value}")
+                    value = "Non specificato"
+                extracted[field_name] = value
+            return extracted
+
+        except Exception as e:
+            logger.warning(f"⚠️ Estrazione batched fallita: {e}")
+            return None
+
     def extract_structured_info_hybrid(self, rag_system, full_document: str, filename: str, source_file: str) -> Dict:
         """
         Estrae informazioni usando approccio ibrido: RAG per campi specifici + documento completo per contesto
@@ -181,14 +689,16 @@ class ExtractorAgent:
                 "instruction": "Cerca la data da cui è possibile presentare domanda. Cerca frasi come: 'a partire dal', 'apertura sportello', 'dalle ore', 'dal giorno', 'presentazione domande dal'. Controlla anche date scritte in forma testuale come '28 marzo 2025', '15 aprile', etc. Se trovi solo mese e giorno, aggiungi l'anno basandoti sul contesto del bando.",
                 "examples": "15/01/2024, 01/02/2024, 28/03/2025, dal 15 marzo 2025",
                 "format": "DD/MM/YYYY",
-                "validator": lambda x: x == "Non specificato" or (len(x.split('/')) == 3 and x[2] == '/')
+                "validator": _valid_date,
+                "max_tokens": 32
             },
             "Chiusura": {
                 "query": "scadenza termine chiusura presentazione domande entro ultimo giorno ore marzo aprile maggio giugno luglio agosto settembre ottobre novembre dicembre gennaio febbraio",
                 "instruction": "Trova l'ultimo giorno utile per presentare domanda. Cerca: 'entro il', 'termine', 'scadenza', 'fino al', 'chiusura sportello', 'ultimo giorno', 'ore 12:00 del'. Attenzione a date in forma testuale come '30 aprile 2025'. Se trovi solo giorno e mese, deduci l'anno dal contesto.",
                 "examples": "31/12/2024, 30/06/2024, 15/09/2024, entro il 30 aprile 2025",
                 "format": "DD/MM/YYYY",
-                "validator": lambda x: x == "Non specificato" or (len(x.split('/')) == 3 and x[2] == '/')
+                "validator": _valid_date,
+                "max_tokens": 32
             },
             "Dotazione finanziaria": {
                 "query": "dotazione finanziaria budget stanziamento risorse disponibili totale euro",
@@ -210,165 +720,180 @@ class ExtractorAgent:
             }
         }
         
-        print("🔄 Inizio estrazione ibrida...")
+        logger.info("🔄 Inizio estrazione ibrida...")
         extracted_data = {}
+
+        # Step 1: prova l'estrazione batched (una sola chiamata LLM per tutti i campi)
+        batched_data = self.extract_all_fields_batched(
+            rag_system, field_configs, full_document, source_file)
+        if batched_data is not None:
+            extracted_data.update(batched_data)
+            for field_name, value in batched_data.items():
+                if value != "Non specificato":
+                    logger.debug(f"✅ {field_name}: {value[:50]}...")
+                else:
+                    logger.warning(f"⚠️ {field_name}: Non trovato")
+        else:
+            # Fallback: estrai ogni campo usando RAG, in parallelo.
+            # Le chiamate sono network-bound (RAG + LLM), quindi sovrapporle
+            # riduce la latenza di questa fase al campo più lento.
+            logger.warning("⚠️ JSON batched non valido, fallback all'estrazione per campo")
+            self._warm_query_vectors(rag_system, field_configs)
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                futures = {
+                    field_name: executor.submit(
+                        self.extract_field_with_rag, rag_system, field_name, config, source_file)
+                    for field_name, config in field_configs.items()
+                }
+                for field_name, future in futures.items():
+                    value = future.result()
+                    extracted_data[field_name] = value
+
+                    if value != "Non specificato":
+                        logger.debug(f"✅ {field_name}: {value[:50]}...")
+                    else:
+                        logger.warning(f"⚠️ {field_name}: Non trovato")
         
-        # Step 1: Estrai ogni campo usando RAG
-        for field_name, config in field_configs.items():
-            print(f"   📍 Estrazione {field_name}...")
-            value = self.extract_field_with_rag(rag_system, field_name, config)
-            extracted_data[field_name] = value
-            
-            if value != "Non specificato":
-                print(f"   ✅ {field_name}: {value[:50]}...")
-            else:
-                print(f"   ⚠️ {field_name}: Non trovato")
-        
-        # Step 2: Usa il documento completo per campi derivati
-        print("   📍 Elaborazione campi aggiuntivi...")
-        
-        # Descrizione aggiuntiva - usa il documento completo per sintesi
-        if len(full_document) > 500:
-            desc_prompt = f"""
-            Basandoti su questo estratto del bando e sui dati già estratti, crea una descrizione sintetica (max 150 parole) di cosa finanzia il bando:
-            
-            ESTRATTO DOCUMENTO:
-            {full_document[:2000]}
-            
-            DATI GIÀ ESTRATTI:
-            Ente: {extracted_data.get('Ente erogatore', 'N/A')}
-            Titolo: {extracted_data.get('Titolo dell\'avviso', 'N/A')}
-            Beneficiari: {extracted_data.get('Beneficiari', 'N/A')}
-            
-            Descrivi: obiettivi principali, cosa viene finanziato, finalità del bando.
-            """
-            
-            try:
-                extracted_data["Descrizione aggiuntiva"] = self.llm.call(desc_prompt).strip()
-            except:
-                extracted_data["Descrizione aggiuntiva"] = "Bando per il finanziamento di progetti innovativi"
-        
-        # Parole chiave - estrai dal documento completo
-        keywords_prompt = f"""
-        Estrai 5-7 parole chiave che caratterizzano questo bando.
-        
-        TITOLO: {extracted_data.get('Titolo dell\'avviso', 'N/A')}
-        BENEFICIARI: {extracted_data.get('Beneficiari', 'N/A')}
-        
-        ESTRATTO:
-        {full_document[:1000]}
-        
-        Rispondi SOLO con le parole chiave separate da virgola.
+        # Step 1b: pre-parsing deterministico delle date mancanti via regex.
+        # Nel caso comune ("a partire dal 28 marzo 2025", "entro il 30/04/2025")
+        # la data si trova senza alcuna chiamata LLM.
+        if any(extracted_data.get(f) == "Non specificato" for f in ("Apertura", "Chiusura")):
+            regex_dates = _extract_dates_regex(full_document)
+            for date_field, date_value in regex_dates.items():
+                if extracted_data.get(date_field) == "Non specificato":
+                    extracted_data[date_field] = date_value
+                    logger.debug(f"🔧 Data {date_field.lower()} trovata via regex: {date_value}")
+
+        # Step 2: campi derivati e date mancanti in UN'UNICA chiamata LLM.
+        # Il documento compare una sola volta, in testa al prompt: i prompt
+        # separati per descrizione, parole chiave e ricerca date re-inviavano
+        # (e re-tokenizzavano) lo stesso estratto 3-4 volte, mentre il prefisso
+        # comune documento-prima resta cache-friendly lato Azure.
+        logger.debug("📍 Elaborazione campi aggiuntivi...")
+
+        # (variabile di appoggio: un backslash nelle espressioni f-string non è
+        # valido prima di Python 3.12)
+        titolo_avviso = extracted_data.get("Titolo dell'avviso", 'N/A')
+
+        # Estratto calcolato una sola volta e riusato, byte-identico, in testa
+        # a tutti i prompt di questo documento: il prompt caching di Azure
+        # (prefissi ≥1024 token) deduplica le chiamate derivata e di validazione
+        head_5k = _document_head(full_document, 5000)
+
+        derived_prompt = f"""
+        DOCUMENTO (estratto):
+        {head_5k}
+
+        DATI GIÀ ESTRATTI:
+        Ente: {extracted_data.get('Ente erogatore', 'N/A')}
+        Titolo: {titolo_avviso}
+        Beneficiari: {extracted_data.get('Beneficiari', 'N/A')}
+
+        Basandoti sul documento sopra, rispondi SOLO con un oggetto JSON con queste chiavi:
+        - "Descrizione aggiuntiva": descrizione sintetica (max 150 parole) di obiettivi principali, cosa viene finanziato e finalità del bando
+        - "Parole chiave": 5-7 parole chiave separate da virgola che caratterizzano il bando
+        - "Apertura": data di apertura presentazione domande in formato DD/MM/YYYY (cerca 'a partire dal', 'apertura sportello', date testuali come '28 marzo 2025'; deduci l'anno dal contesto se manca) o "Non trovata"
+        - "Chiusura": data di chiusura in formato DD/MM/YYYY (cerca 'entro il', 'scadenza', 'termine ultimo', 'ore 12:00 del') o "Non trovata"
         """
-        
+
         try:
-            extracted_data["Parole chiave"] = self.llm.call(keywords_prompt).strip()
+            response = self._cached_llm_call(derived_prompt, max_tokens=512)
+            json_start = response.find('{')
+            json_end = response.rfind('}') + 1
+            derived_data = _json_loads(response[json_start:json_end])
         except:
-            extracted_data["Parole chiave"] = "innovazione, digitalizzazione, PMI, Lombardia"
-        
+            derived_data = {}
+
+        extracted_data["Descrizione aggiuntiva"] = \
+            str(derived_data.get("Descrizione aggiuntiva") or "Bando per il finanziamento di progetti innovativi").strip()
+        extracted_data["Parole chiave"] = \
+            str(derived_data.get("Parole chiave") or "innovazione, digitalizzazione, PMI, Lombardia").strip()
+
+        # Recupera le date mancanti dalla stessa risposta
+        for date_field in ("Apertura", "Chiusura"):
+            if extracted_data.get(date_field) == "Non specificato":
+                date_value = str(derived_data.get(date_field, "")).strip()
+                if date_value and date_value != "Non trovata" and "/" in date_value:
+                    extracted_data[date_field] = date_value
+                    logger.debug(f"🔧 Trovata data {date_field.lower()}: {date_value}")
+
         # Determina se il bando è aperto
         apertura = extracted_data.get("Apertura", "Non specificato")
         chiusura = extracted_data.get("Chiusura", "Non specificato")
         
         if chiusura != "Non specificato":
+            # Confronto diretto di tuple (anno, mese, giorno): evita strptime
+            # (che compila una regex per format string) e la creazione di
+            # due datetime per un confronto tra sole date
             try:
-                from datetime import datetime
-                oggi = datetime.now()
-                
-                # Converti la data di chiusura
-                data_chiusura = datetime.strptime(chiusura, "%d/%m/%Y")
-                
-                # Confronta con oggi per determinare se è aperto
-                if oggi <= data_chiusura:
-                    extracted_data["Aperto"] = "si"
-                    print(f"   ✅ Bando APERTO (scade il {chiusura})")
-                else:
-                    extracted_data["Aperto"] = "no"
-                    print(f"   ❌ Bando CHIUSO (scaduto il {chiusura})")
-                    
-            except Exception as e:
-                print(f"   ⚠️ Errore nel calcolo stato bando: {e}")
+                giorno, mese, anno = chiusura.split('/')
+                chiuso = (int(anno), int(mese), int(giorno)) < date.today().timetuple()[:3]
+            except ValueError as e:
+                logger.warning(f"⚠️ Errore nel calcolo stato bando: {e}")
                 extracted_data["Aperto"] = "Non specificato"
+            else:
+                # Entrambi gli esiti sono risultati normali dell'estrazione:
+                # stesso livello INFO, error resta per i fallimenti veri
+                if chiuso:
+                    extracted_data["Aperto"] = "no"
+                    logger.info(f"❌ Bando CHIUSO (scaduto il {chiusura})")
+                else:
+                    extracted_data["Aperto"] = "si"
+                    logger.info(f"✅ Bando APERTO (scade il {chiusura})")
         else:
             # Se non c'è data di chiusura, non possiamo determinare se è aperto
             extracted_data["Aperto"] = "Non specificato"
-            print("   ⚠️ Stato bando non determinabile (manca data chiusura)")
+            logger.warning("⚠️ Stato bando non determinabile (manca data chiusura)")
         
         # Aggiungi il nome del file
         extracted_data["Nome file"] = filename
         
-        # Step 3: Validazione finale con documento completo - focus su date mancanti
-        print("   📍 Validazione finale...")
-        
-        # Se le date sono ancora "Non specificato", prova una ricerca più ampia
-        if extracted_data.get("Apertura") == "Non specificato" or extracted_data.get("Chiusura") == "Non specificato":
-            date_search_prompt = f"""
-            Nel seguente documento, trova le date di apertura e chiusura per la presentazione delle domande.
-            
-            DOCUMENTO:
-            {full_document[:5000]}
-            
-            Cerca con attenzione:
-            - Date in formato testuale (es. "28 marzo", "15 aprile 2025")
-            - Riferimenti a "apertura sportello", "presentazione domande dal"
-            - Riferimenti a "scadenza", "termine ultimo", "chiusura sportello"
-            - Orari specifici (es. "ore 12:00 del 30 aprile")
-            
-            Se trovi date in formato testuale, convertile in DD/MM/YYYY.
-            Se manca l'anno, deducilo dal contesto (campagna 2025, bando 2025-2026, etc.)
-            
-            Rispondi in questo formato:
-            Apertura: [data in formato DD/MM/YYYY o "Non trovata"]
-            Chiusura: [data in formato DD/MM/YYYY o "Non trovata"]
-            """
-            
-            try:
-                date_response = self.llm.call(date_search_prompt)
-                
-                # Parse della risposta per estrarre le date
-                lines = date_response.strip().split('\n')
-                for line in lines:
-                    if 'Apertura:' in line and extracted_data.get("Apertura") == "Non specificato":
-                        date_value = line.split(':', 1)[1].strip()
-                        if date_value != "Non trovata" and "/" in date_value:
-                            extracted_data["Apertura"] = date_value
-                            print(f"   🔧 Trovata data apertura: {date_value}")
-                    elif 'Chiusura:' in line and extracted_data.get("Chiusura") == "Non specificato":
-                        date_value = line.split(':', 1)[1].strip()
-                        if date_value != "Non trovata" and "/" in date_value:
-                            extracted_data["Chiusura"] = date_value
-                            print(f"   🔧 Trovata data chiusura: {date_value}")
-            except:
-                pass
-        
+        # Step 3: validazione finale, solo se serve. Se tutti i campi sono
+        # popolati non c'è nulla da correggere (la validazione tiene comunque
+        # solo i valori che erano "Non specificato"): salta la chiamata LLM.
+        missing_fields = [k for k, v in extracted_data.items() if v == "Non specificato"]
+        if not missing_fields:
+            logger.info("✅ Estrazione ibrida completata (nessun campo mancante, validazione saltata)")
+            return extracted_data
+
+        logger.debug(f"📍 Validazione finale ({len(missing_fields)} campi mancanti)...")
+
+        # Prompt ristretto ai soli campi mancanti: meno token in ingresso
+        # e in uscita rispetto al re-invio dell'intero dizionario
+        missing_json = _json_dumps({k: extracted_data[k] for k in missing_fields})
+
+        # Documento in testa, con lo stesso estratto (byte-identico) del prompt
+        # derivato: il prefisso condiviso è già nella cache lato Azure, quindi
+        # i token del documento vengono riusati invece che ri-elaborati
         validation_prompt = f"""
-        Verifica questi dati estratti confrontandoli con il documento.
-        Se trovi informazioni mancanti o errate, correggile.
-        
-        DATI ESTRATTI:
-        {json.dumps(extracted_data, ensure_ascii=False, indent=2)}
-        
-        ESTRATTO DOCUMENTO PER VERIFICA:
-        {full_document[:3000]}
-        
+        DOCUMENTO (estratto):
+        {head_5k}
+
+        Nel documento sopra cerca SOLO i seguenti campi, risultati mancanti
+        in una prima estrazione. Se trovi il valore, compilalo; altrimenti
+        lascia "Non specificato".
+
+        CAMPI MANCANTI:
+        {missing_json}
+
         Rispondi SOLO con il JSON corretto e completo. Non aggiungere spiegazioni.
         """
         
         try:
-            response = self.llm.call(validation_prompt)
+            response = self._cached_llm_call(validation_prompt, max_tokens=2048)
             json_start = response.find('{')
             json_end = response.rfind('}') + 1
             if json_start >= 0 and json_end > json_start:
-                validated_data = json.loads(response[json_start:json_end])
+                validated_data = _json_loads(response[json_start:json_end])
                 # Mantieni solo i campi che erano "Non specificato" e ora hanno un valore
                 for key, value in validated_data.items():
                     if key in extracted_data and extracted_data[key] == "Non specificato" and value != "Non specificato":
                         extracted_data[key] = value
-                        print(f"   🔧 Corretto {key}: {value[:50]}...")
+                        logger.debug(f"🔧 Corretto {key}: {value[:50]}...")
         except:
-            print("   ⚠️ Validazione fallita, mantengo dati originali")
+            logger.warning("⚠️ Validazione fallita, mantengo dati originali")
         
-        print("✅ Estrazione ibrida completata")
+        logger.info("✅ Estrazione ibrida completata")
         return extracted_data
     
     def extract_structured_info(self, full_document: str, filename: str) -> Dict:
@@ -376,7 +901,7 @@ class ExtractorAgent:
         Metodo legacy mantenuto per compatibilità
         """
         # Fallback al metodo originale se chiamato senza RAG
-        print("⚠️ Usando metodo legacy senza RAG - risultati potrebbero essere imprecisi")
+        logger.warning("⚠️ Usando metodo legacy senza RAG - risultati potrebbero essere imprecisi")
         return self.extract_structured_info_hybrid(None, full_document, filename, "")
     
     def create_agent(self) -> Agent:
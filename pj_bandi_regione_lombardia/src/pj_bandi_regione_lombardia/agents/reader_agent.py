@@ -1,61 +1,189 @@
 # agents/reader_agent.py
 from crewai import Agent
-from crewai.llm import LLM
+from agents._llm_client import get_llm, get_sync_client
 from rag import RagSystem
+import asyncio
+import hashlib
+import json
+import logging
 import os
 import pathlib
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from functools import lru_cache
 from typing import List, Dict
 
+import numpy as np
+from langchain_core.documents import Document
+
+from tools.simd_similarity import best_match
+
+# redis è opzionale: secondo livello di cache condiviso tra processi,
+# attivo solo se il pacchetto è installato e REDIS_URL è configurata
+try:
+    import redis
+    _HAS_REDIS = True
+except ImportError:
+    _HAS_REDIS = False
+
+# Logger di modulo al posto di print: i livelli sotto soglia non pagano
+# né formattazione né flush sincrono di stdout
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1)
+def _get_default_rag() -> RagSystem:
+    """
+    Crea una sola volta per processo il RagSystem condiviso, con il vector store
+    già caricato. Evita di ripetere per ogni agente la costruzione dei client
+    Azure e la deserializzazione dell'indice FAISS.
+    """
+    logger.info("Inizializzazione sistema RAG condiviso...")
+    rag_system = RagSystem(
+        api_key=os.getenv("AZURE_API_KEY"),
+        api_end_point=os.getenv("AZURE_API_BASE"),
+        api_version=os.getenv("AZURE_API_VERSION"),
+        embedding_model=os.getenv("AZURE_EMBEDDING_MODEL"),
+        llm_model=os.getenv("AZURE_LLM_MODEL")
+    )
+
+    # Carica vector store esistente
+    base_dir = pathlib.Path(__file__).parent.parent.parent
+    db_folder = base_dir / "db"
+
+    if not db_folder.exists():
+        raise FileNotFoundError(f"Cartella vector store non trovata: {db_folder}")
+
+    # mmap dell'indice FAISS: le pagine entrano on-demand e, con più worker
+    # sullo stesso host, vengono condivise tramite la page cache del kernel
+    logger.info(f"Caricamento vector store da: {db_folder}")
+    rag_system.load_vector_store_mmap(vector_store_path=str(db_folder))
+    logger.info("Vector store caricato con successo!")
+    return rag_system
+
+
+class _QueryBatcher:
+    """
+    Coalizza le ricerche FAISS concorrenti in una sola chiamata vettorizzata.
+    Le richieste arrivate entro una piccola finestra (50 ms, max 16) vengono
+    impilate e servite da un unico batch_retrieve: una ricerca (B, d) costa
+    molto meno di B ricerche singole perché FAISS la riduce a un GEMM. Con un
+    solo chiamante la finestra aggiunge al più 50 ms; con più sessioni o
+    thread concorrenti il costo per query crolla.
+    """
+
+    def __init__(self, rag_system: RagSystem, window: float = 0.05, max_batch: int = 16):
+        self._rag_system = rag_system
+        self._window = window
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, business_idea: str, k: int) -> Future:
+        """Accoda una ricerca e restituisce il Future con i documenti trovati"""
+        future = Future()
+        self._queue.put((business_idea, k, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._window
+            while len(batch) < self._max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # una ricerca vettorizzata per ciascun k presente nel batch
+            by_k = {}
+            for idea, k, future in batch:
+                by_k.setdefault(k, []).append((idea, future))
+            for k, entries in by_k.items():
+                try:
+                    fetched = self._rag_system.batch_retrieve([idea for idea, _ in entries], k=k)
+                    for (_, future), documents in zip(entries, fetched):
+                        future.set_result(documents)
+                except Exception as e:
+                    for _, future in entries:
+                        if not future.done():
+                            future.set_exception(e)
+
+
 class ReaderAgent:
-    def __init__(self):
-        # Configurazione Azure OpenAI con crewai.llm.LLM
-        print("Configurazione LLM CrewAI...")
-        self.llm = LLM(
-            model=f"azure/{os.getenv('AZURE_LLM_MODEL')}",
-            api_key=os.getenv("AZURE_API_KEY"),
-            api_base=os.getenv("AZURE_API_BASE"),
-            api_version=os.getenv("AZURE_API_VERSION"),
-            temperature=0.7,
-            max_tokens=4000
-        )
-        print(f"✅ LLM configurato con model: azure/{os.getenv('AZURE_LLM_MODEL')}")
-        
-        # Inizializzazione sistema RAG
-        print("Inizializzazione sistema RAG...")
-        self.rag_system = RagSystem(
-            api_key=os.getenv("AZURE_API_KEY"),
-            api_end_point=os.getenv("AZURE_API_BASE"),
-            api_version=os.getenv("AZURE_API_VERSION"),
-            embedding_model=os.getenv("AZURE_EMBEDDING_MODEL"),
-            llm_model=os.getenv("AZURE_LLM_MODEL")
-        )
-        
-        # Carica vector store esistente
-        base_dir = pathlib.Path(__file__).parent.parent.parent
-        db_folder = base_dir / "db"
-        
-        if not db_folder.exists():
-            raise FileNotFoundError(f"Cartella vector store non trovata: {db_folder}")
-        
-        print(f"Caricamento vector store da: {db_folder}")
-        self.rag_system.load_vector_store(vector_store_path=str(db_folder))
-        print("Vector store caricato con successo!")
-        
-        # Stato della conversazione
-        self.conversation_history = []
+    def __init__(self, rag_system: RagSystem = None):
+        # LLM condiviso a livello di processo: riusa le connessioni TCP/TLS
+        # invece di aprire un client per agente
+        logger.info("Configurazione LLM CrewAI...")
+        self.llm = get_llm(temperature=0.7, max_tokens=4000)
+        logger.info(f"✅ LLM configurato con model: azure/{os.getenv('AZURE_LLM_MODEL')}")
+
+        # Sistema RAG: riusa l'istanza passata oppure il singleton di modulo,
+        # così più agenti condividono lo stesso indice FAISS e gli stessi client
+        self.rag_system = rag_system if rag_system is not None else _get_default_rag()
+
+        # Stato della conversazione: deque con finestra fissa, così l'append
+        # scarta da solo gli scambi più vecchi senza copie via slicing
+        self.conversation_history = deque(maxlen=10)
         self.current_document = None
         self.current_metadata = None
         self.current_filename = None
+        self._stable_prefix = None
+
+        # Cache a due livelli dei risultati di ricerca: la stessa idea di
+        # business viene ricercata più volte (retry, re-planning, debug) e
+        # ogni miss costa un embedding Azure + una ricerca FAISS.
+        # L1: LRU in memoria; L2 (opzionale): Redis condiviso tra processi.
+        self._search_cache = OrderedDict()
+        self._search_cache_size = 1024
+        self._search_cache_lock = threading.Lock()
+
+        # Cache semantica della chat: coppie (embedding domanda -> risposta)
+        # sul documento corrente. In una sessione Q&A molti follow-up sono
+        # quasi-duplicati ("chi può partecipare?" / "quali sono i
+        # beneficiari?"): sopra soglia la risposta torna con un solo prodotto
+        # scalare invece di RAG + LLM. Soglia più permissiva di quella del
+        # RagSystem perché qui le risposte sono scoped al singolo documento.
+        self._chat_cache_threshold = 0.92
+        self._chat_cache_matrix = None
+        self._chat_cache_answers = []
+        # Coalescenza delle ricerche concorrenti (vedi _QueryBatcher)
+        self._query_batcher = _QueryBatcher(self.rag_system)
+
+        self._redis = None
+        if _HAS_REDIS and os.getenv("REDIS_URL"):
+            try:
+                self._redis = redis.Redis.from_url(os.getenv("REDIS_URL"))
+            except Exception as e:
+                logger.warning(f"⚠️ Redis non disponibile, uso solo la cache in memoria: {e}")
         
     def test_llm_connection(self):
         """Testa la connessione LLM prima di usare l'agente"""
         try:
-            print("🧪 Test connessione LLM...")
+            logger.info("🧪 Test connessione LLM...")
             response = self.llm.call("Rispondi solo 'OK' se funzioni.")
-            print(f"✅ LLM funziona: {response}")
+            logger.info(f"✅ LLM funziona: {response}")
             return True
         except Exception as e:
-            print(f"❌ LLM non funziona: {e}")
+            logger.error(f"❌ LLM non funziona: {e}")
+            return False
+
+    async def atest_llm_connection(self):
+        """Variante asincrona di test_llm_connection: non blocca l'event loop"""
+        try:
+            logger.info("🧪 Test connessione LLM (async)...")
+            response = await self.llm.acall("Rispondi solo 'OK' se funzioni.")
+            logger.info(f"✅ LLM funziona: {response}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ LLM non funziona: {e}")
             return False
     
     def extract_filename_from_metadata(self, metadata: dict) -> str:
@@ -66,19 +194,112 @@ class ReaderAgent:
             return filename
         return "Non specificato"
     
+    def search_batch(self, business_ideas: List[str], k: int = 1) -> List[List]:
+        """
+        Cerca i documenti più rilevanti per più idee di business in un colpo solo:
+        un'unica richiesta embeddings per tutte le query e una sola ricerca FAISS
+        vettorizzata, invece di un round-trip per idea.
+
+        Args:
+            business_ideas: Le idee di business da cercare
+            k: Numero di documenti per idea
+
+        Returns:
+            Una lista di documenti per ogni idea, nello stesso ordine
+        """
+        if self.rag_system.vector_store is None:
+            raise ValueError("Vector store non inizializzato.")
+        logger.info(f"🔍 Ricerca batched di {len(business_ideas)} idee di business...")
+
+        # Risolvi prima dalla cache; embedda e cerca solo le idee mancanti
+        keys = [self._search_cache_key(idea, k) for idea in business_ideas]
+        results = [self._search_cache_get(key) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if missing:
+            # Le idee che citano un anno passano dalla ricerca pre-filtrata sui
+            # metadati (IDSelector FAISS: solo gli id dei chunk di quell'anno),
+            # le altre dalla ricerca batch sull'intero indice
+            narrow = [i for i in missing if re.search(r"\b20\d{2}\b", business_ideas[i])]
+            broad = [i for i in missing if i not in narrow]
+            for i in narrow:
+                documents = self.rag_system.prefiltered_search(business_ideas[i], k=k)
+                results[i] = documents
+                self._search_cache_put(keys[i], documents)
+            if broad:
+                # Passa dal batcher: le ricerche di altri thread arrivate
+                # nella stessa finestra vengono servite da un'unica chiamata
+                futures = [self._query_batcher.submit(business_ideas[i], k) for i in broad]
+                for i, future in zip(broad, futures):
+                    documents = future.result()
+                    results[i] = documents
+                    self._search_cache_put(keys[i], documents)
+        return results
+
+    @staticmethod
+    def _search_cache_key(business_idea: str, k: int) -> str:
+        """Chiave di cache: hash dell'idea normalizzata (spazi, maiuscole) e di k"""
+        normalized = " ".join(business_idea.split()).lower()
+        return hashlib.sha256(f"{normalized}\0{k}".encode("utf-8")).hexdigest()
+
+    def _search_cache_get(self, key: str):
+        """Lookup L1 (LRU in memoria) poi L2 (Redis); None se assente"""
+        with self._search_cache_lock:
+            if key in self._search_cache:
+                self._search_cache.move_to_end(key)
+                logger.debug(f"Cache ricerca: HIT L1 ({key[:8]})")
+                return self._search_cache[key]
+
+        if self._redis is not None:
+            try:
+                payload = self._redis.get(key)
+            except Exception as e:
+                logger.warning(f"⚠️ Lettura Redis fallita: {e}")
+                payload = None
+            if payload:
+                documents = [
+                    Document(page_content=content, metadata=metadata)
+                    for content, metadata in json.loads(payload)
+                ]
+                self._search_cache_put(key, documents, redis_write=False)
+                logger.debug(f"Cache ricerca: HIT L2 ({key[:8]})")
+                return documents
+
+        logger.debug(f"Cache ricerca: MISS ({key[:8]})")
+        return None
+
+    def _search_cache_put(self, key: str, documents: List, redis_write: bool = True):
+        """Inserisce nei due livelli di cache (TTL di un'ora su Redis)"""
+        with self._search_cache_lock:
+            self._search_cache[key] = documents
+            self._search_cache.move_to_end(key)
+            while len(self._search_cache) > self._search_cache_size:
+                self._search_cache.popitem(last=False)
+
+        if redis_write and self._redis is not None:
+            try:
+                payload = json.dumps([
+                    [doc.page_content, getattr(doc, 'metadata', {})] for doc in documents
+                ], ensure_ascii=False)
+                self._redis.setex(key, 3600, payload)
+            except Exception as e:
+                logger.warning(f"⚠️ Scrittura Redis fallita: {e}")
+
     def get_most_relevant_document(self, business_idea: str) -> tuple:
         """Recupera il documento RAW più rilevante dal vector store"""
         try:
             if self.rag_system.vector_store is None:
                 return "Errore: Vector store non inizializzato.", {}
-            
-            print(f"🔍 Cercando documento più rilevante per: {business_idea[:100]}...")
-            
-            documents = self.rag_system.vector_store.similarity_search(
-                query=business_idea, 
-                k=1
-            )
-            
+
+            logger.info(f"🔍 Cercando documento più rilevante per: {business_idea[:100]}...")
+
+            # Recupero ibrido denso + keyword (fusione RRF), con la stessa
+            # cache a due livelli delle ricerche batched
+            key = self._search_cache_key(f"hybrid\0{business_idea}", 1)
+            documents = self._search_cache_get(key)
+            if documents is None:
+                documents = self.rag_system.hybrid_retrieve(business_idea, k=1)
+                self._search_cache_put(key, documents)
+
             if documents and len(documents) > 0:
                 most_relevant_doc = documents[0]
                 document_content = most_relevant_doc.page_content
@@ -88,84 +309,208 @@ class ReaderAgent:
                 self.current_document = document_content
                 self.current_metadata = metadata
                 self.current_filename = self.extract_filename_from_metadata(metadata)
+                self._stable_prefix = None  # nuovo documento, nuovo prefisso
+                self._chat_cache_reset()  # le risposte valgono per documento
                 
-                print(f"✅ Documento trovato! Lunghezza: {len(document_content)} caratteri")
+                logger.info(f"✅ Documento trovato! Lunghezza: {len(document_content)} caratteri")
                 if metadata:
-                    print(f"📄 Metadata: {metadata}")
+                    logger.info(f"📄 Metadata: {metadata}")
                 
                 return document_content, metadata
             else:
-                print("❌ Nessun documento rilevante trovato nel database.")
+                logger.error("❌ Nessun documento rilevante trovato nel database.")
                 return "Nessun documento rilevante trovato nel database vettoriale.", {}
                 
         except Exception as e:
             error_msg = f"Errore nel recupero documento RAG: {str(e)}"
-            print(f"❌ {error_msg}")
+            logger.error(f"❌ {error_msg}")
             return error_msg, {}
     
+    def _chat_cache_reset(self):
+        """Svuota la cache semantica della chat (cambio documento o reset)"""
+        self._chat_cache_matrix = None
+        self._chat_cache_answers = []
+
+    def _chat_cache_lookup(self, user_question: str):
+        """
+        Cerca una domanda quasi-duplicata tra quelle già risposte sul
+        documento corrente.
+
+        Returns:
+            (vettore normalizzato della domanda, risposta in cache oppure None)
+        """
+        vector = np.asarray(
+            self.rag_system._embed_query_cached(user_question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        if self._chat_cache_matrix is not None and self._chat_cache_matrix.shape[0] > 0:
+            hit, score = best_match(vector, self._chat_cache_matrix)
+            if score >= self._chat_cache_threshold:
+                logger.info(f"✅ Cache semantica chat: HIT (score {score:.3f})")
+                return vector, self._chat_cache_answers[hit]
+        return vector, None
+
+    def _chat_cache_store(self, vector, answer: str):
+        """Registra la coppia (embedding domanda, risposta) nella cache"""
+        row = vector.reshape(1, -1)
+        if self._chat_cache_matrix is None:
+            self._chat_cache_matrix = row
+        else:
+            self._chat_cache_matrix = np.vstack((self._chat_cache_matrix, row))
+        self._chat_cache_answers.append(answer)
+
     def chat_about_document(self, user_question: str) -> str:
         """Gestisce una conversazione continua sul documento corrente"""
         if not self.current_document:
             return "Nessun documento caricato. Cerca prima un documento con un'idea di business."
-        
-        # Aggiungi la domanda alla storia
+
         self.conversation_history.append({"role": "user", "content": user_question})
-        
-        # Costruisci il contesto della conversazione
-        conversation_context = f"""
-        Stai analizzando il seguente documento di bando:
-        File: {self.current_filename}
-        
-        ESTRATTO DEL DOCUMENTO:
-        {self.current_document[:2000]}...
-        
-        STORICO CONVERSAZIONE:
+
+        try:
+            # Domande quasi-duplicate: risposta dalla cache semantica senza
+            # passare da RAG + LLM
+            query_vector, cached = self._chat_cache_lookup(user_question)
+            if cached is not None:
+                self.conversation_history.append({"role": "assistant", "content": cached})
+                return cached
+
+            # Usa il RAG system per cercare informazioni specifiche nel documento
+            rag_response = self.rag_system.generate(user_question, k=3)
+
+            prompt = self._build_chat_prompt(rag_response.content)
+            response = self.llm.call(prompt)
+
+            # Salva la risposta nella storia e nella cache semantica
+            self.conversation_history.append({"role": "assistant", "content": response})
+            self._chat_cache_store(query_vector, response)
+
+            return response
+
+        except Exception as e:
+            error_msg = f"Errore durante la chat: {str(e)}"
+            logger.error(f"❌ {error_msg}")
+            return error_msg
+
+    def chat_about_document_stream(self, user_question: str):
         """
-        
-        # Aggiungi gli ultimi 5 scambi
-        for exchange in self.conversation_history[-10:]:
-            conversation_context += f"\n{exchange['role'].upper()}: {exchange['content']}"
-        
-        # Prompt per rispondere
-        prompt = f"""
-        {conversation_context}
-        
-        Rispondi alla domanda dell'utente basandoti sul documento del bando.
-        Sii preciso e fai riferimento a sezioni specifiche quando possibile.
-        Se l'informazione richiesta non è presente nel documento, dillo chiaramente.
+        Variante streaming di chat_about_document: genera i frammenti di testo
+        man mano che arrivano da Azure, così la UI può mostrare il primo token
+        subito invece di aspettare l'intera risposta (adatta a
+        st.write_stream). Lo storico viene aggiornato a fine stream con la
+        risposta completa.
         """
-        
+        if not self.current_document:
+            yield "Nessun documento caricato. Cerca prima un documento con un'idea di business."
+            return
+
+        self.conversation_history.append({"role": "user", "content": user_question})
+
         try:
-            # Usa il RAG system per cercare informazioni specifiche nel documento
+            # Hit nella cache semantica: l'intera risposta è già disponibile,
+            # la si emette in un unico frammento
+            query_vector, cached = self._chat_cache_lookup(user_question)
+            if cached is not None:
+                self.conversation_history.append({"role": "assistant", "content": cached})
+                yield cached
+                return
+
             rag_response = self.rag_system.generate(user_question, k=3)
-            
-            # Combina la risposta RAG con il contesto della conversazione
-            final_prompt = f"""
-            Basandoti su queste informazioni dal documento:
-            {rag_response.content}
-            
-            E considerando il contesto della conversazione:
-            {conversation_context}
-            
-            Fornisci una risposta completa e contestualizzata alla domanda dell'utente.
-            """
-            
-            response = self.llm.call(final_prompt)
-            
-            # Salva la risposta nella storia
+            prompt = self._build_chat_prompt(rag_response.content)
+
+            stream = get_sync_client().chat.completions.create(
+                model=os.getenv("AZURE_LLM_MODEL"),
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=4000,
+                stream=True
+            )
+
+            parts = []
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+            answer = "".join(parts)
+            self.conversation_history.append({"role": "assistant", "content": answer})
+            self._chat_cache_store(query_vector, answer)
+
+        except Exception as e:
+            error_msg = f"Errore durante la chat: {str(e)}"
+            logger.error(f"❌ {error_msg}")
+            yield error_msg
+
+    async def achat_about_document(self, user_question: str) -> str:
+        """
+        Variante asincrona di chat_about_document: la ricerca RAG (sincrona)
+        gira in un thread e la chiamata LLM usa acall, così dentro i workflow
+        asincroni di CrewAI l'event loop resta libero e più agenti procedono
+        in parallelo.
+        """
+        if not self.current_document:
+            return "Nessun documento caricato. Cerca prima un documento con un'idea di business."
+
+        self.conversation_history.append({"role": "user", "content": user_question})
+
+        try:
+            rag_response = await asyncio.to_thread(self.rag_system.generate, user_question, 3)
+
+            prompt = self._build_chat_prompt(rag_response.content)
+            response = await self.llm.acall(prompt)
+
             self.conversation_history.append({"role": "assistant", "content": response})
-            
+
             return response
-            
+
         except Exception as e:
             error_msg = f"Errore durante la chat: {str(e)}"
-            print(f"❌ {error_msg}")
+            logger.error(f"❌ {error_msg}")
             return error_msg
+
+    def _build_chat_prompt(self, rag_content: str) -> str:
+        """
+        Costruisce il prompt della chat. Il prefisso stabile (documento +
+        istruzioni) è identico byte per byte a ogni turno, così il prompt
+        cache lato Azure resta caldo; le parti che cambiano (contesto RAG e
+        storico) vengono in coda. Un'unica chiamata LLM al posto delle due
+        annidate di prima.
+        """
+        if self._stable_prefix is None:
+            self._stable_prefix = f"""
+        Stai analizzando il seguente documento di bando:
+        File: {self.current_filename}
+
+        ESTRATTO DEL DOCUMENTO:
+        {self.current_document[:2000]}...
+
+        Rispondi alla domanda dell'utente basandoti sul documento del bando.
+        Sii preciso e fai riferimento a sezioni specifiche quando possibile.
+        Se l'informazione richiesta non è presente nel documento, dillo chiaramente.
+        """
+
+        history_lines = "\n".join(
+            f"{exchange['role'].upper()}: {exchange['content']}"
+            for exchange in self.conversation_history
+        )
+
+        return f"""
+        {self._stable_prefix}
+
+        INFORMAZIONI RECUPERATE DAL DOCUMENTO:
+        {rag_content}
+
+        STORICO CONVERSAZIONE:
+        {history_lines}
+
+        Fornisci una risposta completa e contestualizzata all'ultima domanda dell'utente.
+        """
     
     def reset_conversation(self):
         """Resetta la conversazione mantenendo il documento"""
-        self.conversation_history = []
-        print("✅ Conversazione resettata")
+        self.conversation_history.clear()
+        self._chat_cache_reset()
+        logger.info("✅ Conversazione resettata")
     
     def create_chat_agent(self) -> Agent:
         """Crea un agente specifico per la chat interattiva"""
@@ -187,5 +532,13 @@ class ReaderAgent:
             verbose=True,
             allow_delegation=False,
             llm=self.llm,
-            memory=True
+            memory=True,
+            # Tool di retrieval singolo e batched: con il tool calling parallelo
+            # di Azure un solo turno del modello può chiedere più ricerche
+            # insieme, quindi bastano pochissime iterazioni
+            tools=[
+                self.rag_system.get_retriever_tool(k=5),
+                self.rag_system.get_batch_retriever_tool(k=5)
+            ],
+            max_iter=3
         )
\ No newline at end of file
@@ -1,72 +1,111 @@
 # agents/writer_agent.py
 from crewai import Agent
-from crewai.llm import LLM
-import os
 import json
+import logging
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 import pandas as pd
 from datetime import datetime
 
+from agents._llm_client import get_llm
+
+# orjson è opzionale: parser C molto più veloce di json, ma il modulo
+# funziona anche senza (stesso pattern degli altri agenti)
+try:
+    import orjson
+    _HAS_ORJSON = True
+except ImportError:
+    _HAS_ORJSON = False
+
+
+def _json_loads(data: bytes):
+    """Deserializza JSON con orjson se disponibile, altrimenti json stdlib."""
+    if _HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+logger = logging.getLogger(__name__)
+
+# Colonne del report Excel, nell'ordine richiesto
+EXCEL_COLUMNS = [
+    "Ente erogatore",
+    "Titolo dell'avviso",
+    "Descrizione aggiuntiva",
+    "Beneficiari",
+    "Apertura",
+    "Chiusura",
+    "Dotazione finanziaria",
+    "Contributo",
+    "Note",
+    "Link",
+    "Key Words",
+    "Aperto"
+]
+
+# Chiavi JSON che hanno un nome diverso nella colonna Excel
+_COLUMN_RENAMES = {
+    "Parole chiave": "Key Words",
+    "_filename": "Link"
+}
+
+
 class WriterAgent:
     def __init__(self):
-        # Configurazione LLM (più semplice, non serve alta precisione)
-        self.llm = LLM(
-            model=f"azure/{os.getenv('AZURE_LLM_MODEL')}",
-            api_key=os.getenv("AZURE_API_KEY"),
-            api_base=os.getenv("AZURE_API_BASE"),
-            api_version=os.getenv("AZURE_API_VERSION"),
-            temperature=0.3,
-            max_tokens=2000
-        )
-        print("✅ WriterAgent LLM configurato")
+        # LLM condiviso a livello di processo (più semplice, non serve alta precisione)
+        self.llm = get_llm(temperature=0.3, max_tokens=2000)
+        logger.info("✅ WriterAgent LLM configurato")
         
+    @staticmethod
+    def _read_json_file(json_file: pathlib.Path) -> Dict:
+        """Legge e deserializza un singolo file JSON; None in caso di errore."""
+        try:
+            data = _json_loads(json_file.read_bytes())
+            # Aggiungi il nome del file ai dati
+            data['_filename'] = json_file.name
+            logger.debug(f"   ✅ Letto: {json_file.name}")
+            return data
+        except Exception as e:
+            logger.error(f"   ❌ Errore lettura {json_file.name}: {e}")
+            return None
+
     def read_json_files(self, json_dir: pathlib.Path) -> List[Dict]:
-        """Legge tutti i file JSON dalla directory json_description"""
-        json_data_list = []
-        
+        """
+        Legge tutti i file JSON dalla directory json_description.
+        Le letture sono I/O-bound, quindi avvengono in parallelo con un
+        ThreadPoolExecutor; l'ordine dei file è preservato da executor.map.
+        """
         try:
             # Trova tutti i file JSON nella directory
             json_files = list(json_dir.glob("*.json"))
-            print(f"📁 Trovati {len(json_files)} file JSON da processare")
-            
-            for json_file in json_files:
-                try:
-                    with open(json_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # Aggiungi il nome del file ai dati
-                        data['_filename'] = json_file.name
-                        json_data_list.append(data)
-                        print(f"   ✅ Letto: {json_file.name}")
-                except Exception as e:
-                    print(f"   ❌ Errore lettura {json_file.name}: {e}")
-                    
-            return json_data_list
-            
+            logger.info(f"📁 Trovati {len(json_files)} file JSON da processare")
+
+            if not json_files:
+                return []
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = executor.map(self._read_json_file, json_files)
+
+            return [data for data in results if data is not None]
+
         except Exception as e:
-            print(f"❌ Errore nell'accesso alla directory: {e}")
+            logger.error(f"❌ Errore nell'accesso alla directory: {e}")
             return []
     
-    def map_json_to_excel_columns(self, json_data: Dict) -> Dict:
-        """Mappa i dati JSON alle colonne Excel"""
-        
-        # Definizione delle colonne Excel e mapping con chiavi JSON
-        column_mapping = {
-            "Ente erogatore": json_data.get("Ente erogatore", ""),
-            "Titolo dell'avviso": json_data.get("Titolo dell'avviso", ""),
-            "Descrizione aggiuntiva": json_data.get("Descrizione aggiuntiva", ""),
-            "Beneficiari": json_data.get("Beneficiari", ""),
-            "Apertura": json_data.get("Apertura", ""),
-            "Chiusura": json_data.get("Chiusura", ""),
-            "Dotazione finanziaria": json_data.get("Dotazione finanziaria", ""),
-            "Contributo": json_data.get("Contributo", ""),
-            "Note": "",  # Sempre vuoto come richiesto
-            "Link": json_data.get("_filename", ""),  # Nome del file JSON
-            "Key Words": json_data.get("Parole chiave", ""),  # Mapping diverso
-            "Aperto": json_data.get("Aperto", "")
-        }
-        
-        return column_mapping
+    def map_json_to_excel_columns(self, json_data_list: List[Dict]) -> pd.DataFrame:
+        """
+        Mappa i dati JSON alle colonne Excel in un unico passaggio vettoriale:
+        json_normalize costruisce il DataFrame direttamente dalla lista di dict,
+        rename/reindex applicano mapping e ordine colonne a livello di colonna
+        invece che con un dict Python per riga.
+        """
+        df = pd.json_normalize(json_data_list)
+        df = df.rename(columns=_COLUMN_RENAMES)
+        df["Note"] = ""  # Sempre vuoto come richiesto
+        # reindex aggiunge le colonne mancanti e impone l'ordine richiesto
+        df = df.reindex(columns=EXCEL_COLUMNS, fill_value="")
+        return df.fillna("")
     
     def create_excel_file(self, json_dir: pathlib.Path, output_filename: str = None) -> str:
         """Crea il file Excel con tutti i dati dei JSON"""
@@ -75,7 +114,7 @@ class WriterAgent:
             # Crea la directory excel_output se non esiste
             excel_dir = json_dir.parent / "excel_output"
             excel_dir.mkdir(exist_ok=True)
-            print(f"📁 Directory output Excel: {excel_dir}")
+            logger.info(f"📁 Directory output Excel: {excel_dir}")
             
             # Nome del file Excel
             if not output_filename:
@@ -88,77 +127,58 @@ class WriterAgent:
             json_data_list = self.read_json_files(json_dir)
             
             if not json_data_list:
-                print("⚠️ Nessun file JSON trovato da processare")
+                logger.warning("⚠️ Nessun file JSON trovato da processare")
                 return None
-            
-            # Prepara i dati per il DataFrame
-            rows = []
-            for json_data in json_data_list:
-                row = self.map_json_to_excel_columns(json_data)
-                rows.append(row)
-            
-            # Crea il DataFrame
-            df = pd.DataFrame(rows)
-            
-            # Riordina le colonne nell'ordine specificato
-            column_order = [
-                "Ente erogatore",
-                "Titolo dell'avviso",
-                "Descrizione aggiuntiva",
-                "Beneficiari",
-                "Apertura",
-                "Chiusura",
-                "Dotazione finanziaria",
-                "Contributo",
-                "Note",
-                "Link",
-                "Key Words",
-                "Aperto"
-            ]
-            
-            df = df[column_order]
-            
-            # Salva in Excel con formattazione
-            with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Bandi', index=False)
-                
-                # Ottieni il worksheet per formattazione
-                worksheet = writer.sheets['Bandi']
-                
-                # Formatta l'header
-                for cell in worksheet[1]:
-                    cell.font = cell.font.copy(bold=True)
-                    cell.fill = cell.fill.copy(fgColor="D3D3D3")
-                
-                # Auto-dimensiona le colonne
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    
-                    # Limita la larghezza massima
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
-            
-            print(f"\n✅ File Excel creato: {output_path}")
-            print(f"📊 Totale righe: {len(rows)}")
-            print(f"📍 PATH COMPLETO: {output_path.absolute()}")
-            
+
+            # Crea il DataFrame già mappato e ordinato in un passaggio solo
+            df = self.map_json_to_excel_columns(json_data_list)
+            
+            # Salva in Excel con xlsxwriter in modalità constant_memory:
+            # le righe vengono scritte in streaming e scartate dalla RAM,
+            # invece di costruire l'intero albero del foglio come openpyxl
+            with pd.ExcelWriter(
+                output_path,
+                engine='xlsxwriter',
+                engine_kwargs={"options": {"constant_memory": True}}
+            ) as writer:
+                workbook = writer.book
+                worksheet = workbook.add_worksheet('Bandi')
+
+                # In constant_memory le righe già scritte non sono più
+                # modificabili: l'header formattato va scritto per primo
+                header_fmt = workbook.add_format({"bold": True, "bg_color": "#D3D3D3"})
+                for idx, col in enumerate(df.columns):
+                    worksheet.write(0, idx, col, header_fmt)
+
+                # Corpo scritto riga per riga, in ordine: df.to_excel emette
+                # le celle per colonna e in constant_memory le scritture su
+                # righe già flushate vengono scartate in silenzio (restava
+                # solo la prima colonna intera)
+                for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+                    worksheet.write_row(row_idx, 0, row)
+
+                # Auto-dimensiona le colonne: un solo passaggio vettoriale
+                # pandas sulle stringhe già in memoria (le celle scritte non
+                # sono comunque rileggibili in streaming)
+                widths = (df.astype(str).map(len).max()
+                          .clip(lower=df.columns.str.len(), upper=48) + 2)
+                for idx, width in enumerate(widths):
+                    worksheet.set_column(idx, idx, int(width))
+            
+            logger.info(f"\n✅ File Excel creato: {output_path}")
+            logger.info(f"📊 Totale righe: {len(df)}")
+            logger.info(f"📍 PATH COMPLETO: {output_path.absolute()}")
+
             # Mostra un riepilogo
-            print("\n📋 Riepilogo bandi processati:")
-            for i, row in enumerate(rows, 1):
-                print(f"   {i}. {row['Titolo dell\'avviso'][:50]}... ({row['Link']})")
-            
+            logger.info("\n📋 Riepilogo bandi processati:")
+            titoli = df["Titolo dell'avviso"].astype(str)
+            for i, (titolo, link) in enumerate(zip(titoli, df["Link"]), 1):
+                logger.info(f"   {i}. {titolo[:50]}... ({link})")
+
             return str(output_path)
-            
+
         except Exception as e:
-            print(f"❌ Errore nella creazione del file Excel: {e}")
+            logger.error(f"❌ Errore nella creazione del file Excel: {e}")
             import traceback
             traceback.print_exc()
             return None
@@ -169,22 +189,22 @@ class WriterAgent:
             path = pathlib.Path(excel_path)
             
             if not path.exists():
-                print("❌ File Excel non trovato")
+                logger.error("❌ File Excel non trovato")
                 return False
             
             # Verifica che il file non sia vuoto
             if path.stat().st_size == 0:
-                print("❌ File Excel vuoto")
+                logger.error("❌ File Excel vuoto")
                 return False
             
             # Prova a leggere il file per verificare che sia valido
             df = pd.read_excel(path)
-            print(f"✅ File Excel valido con {len(df)} righe e {len(df.columns)} colonne")
+            logger.info(f"✅ File Excel valido con {len(df)} righe e {len(df.columns)} colonne")
             
             return True
             
         except Exception as e:
-            print(f"❌ Errore validazione Excel: {e}")
+            logger.error(f"❌ Errore validazione Excel: {e}")
             return False
     
     def create_agent(self) -> Agent:
@@ -3,60 +3,141 @@ from crewai import Crew, Process
 from agents.reader_agent import ReaderAgent
 from agents.extractor_agent import ExtractorAgent
 from agents.writer_agent import WriterAgent
+from agents._llm_client import warm_llm_connection
 from tasks.extractor_tasks import ExtractorTasks
+import asyncio
+import logging
 import os
 import pathlib
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeout
+from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
 import json
-import threading
-import time
 
-def validate_environment():
-    """Valida che tutte le variabili d'ambiente necessarie siano configurate"""
-    required_vars = [
-        'AZURE_API_KEY',
-        'AZURE_API_BASE', 
-        'AZURE_API_VERSION',
-        'AZURE_EMBEDDING_MODEL',
-        'AZURE_LLM_MODEL'
-    ]
-    
-    missing_vars = []
-    for var in required_vars:
-        if not os.getenv(var):
-            missing_vars.append(var)
-    
+# orjson è opzionale: serializzazione JSON in C, 5-10x più veloce della
+# stdlib su output indentati; fallback trasparente a json se assente
+try:
+    import orjson
+    _HAS_ORJSON = True
+except ImportError:
+    _HAS_ORJSON = False
+
+
+def _json_dumps_bytes(data) -> bytes:
+    """Serializza in bytes UTF-8 indentati, con orjson quando disponibile"""
+    if _HAS_ORJSON:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+# Configurazione del logging una sola volta, nell'entrypoint: gli agenti
+# usano logger di modulo e qui si decide la soglia (DEBUG per la traccia
+# per campo dell'extractor)
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+# Path di modulo calcolati una volta all'import: evitano di ricostruire gli
+# stessi oggetti Path (e di ripetere il mkdir della cartella di archivio)
+# a ogni chiamata
+_BASE_DIR = pathlib.Path(__file__).resolve().parent
+_JSON_DIR = _BASE_DIR / "json_description"
+_JSON_DIR.mkdir(exist_ok=True)
+_DB_FOLDER = _BASE_DIR.parent / "db"
+
+# Tetti di attesa sui task in background: un'unica wait con timeout al posto
+# di join ripetute, oltre non vale la pena di tenere l'utente appeso
+_EXTRACTOR_TIMEOUT_S = 300
+_WRITER_TIMEOUT_S = 120
+
+@dataclass(frozen=True, slots=True)
+class AzureCfg:
+    """Configurazione Azure validata una volta sola (vedi get_cfg)"""
+    api_key: str
+    api_base: str
+    api_version: str
+    embedding_model: str
+    llm_model: str
+
+
+# Nome attributo -> variabile d'ambiente corrispondente
+_AZURE_ENV_VARS = {
+    'api_key': 'AZURE_API_KEY',
+    'api_base': 'AZURE_API_BASE',
+    'api_version': 'AZURE_API_VERSION',
+    'embedding_model': 'AZURE_EMBEDDING_MODEL',
+    'llm_model': 'AZURE_LLM_MODEL'
+}
+
+
+@lru_cache(maxsize=1)
+def get_cfg():
+    """
+    Legge e valida la configurazione Azure una sola volta per processo.
+    Le chiamate successive restituiscono lo stesso oggetto immutabile senza
+    ripetere lookup su os.environ (l'accesso ad attributo di un dataclass
+    con slots è più economico del dict lookup).
+
+    Returns:
+        AzureCfg se tutte le variabili sono presenti, None altrimenti
+        (con l'elenco delle mancanti stampato una volta sola).
+    """
+    values = {attr: os.environ.get(var) for attr, var in _AZURE_ENV_VARS.items()}
+    missing_vars = [var for attr, var in _AZURE_ENV_VARS.items() if not values[attr]]
+
     if missing_vars:
         print("❌ ERRORE: Variabili d'ambiente mancanti:")
         for var in missing_vars:
             print(f"   - {var}")
         print("\nConfigura queste variabili nel file .env")
-        return False
-    
-    return True
+        return None
+
+    return AzureCfg(**values)
+
+
+def validate_environment():
+    """Valida che tutte le variabili d'ambiente necessarie siano configurate"""
+    return get_cfg() is not None
+
+
+def _emit(*lines):
+    """
+    Stampa un blocco di righe con una sola write: con stdout line-buffered
+    ogni print è una syscall, e i blocchi diagnostici da 5-10 righe su
+    terminali lenti (SSH) si vedono. Stessa resa, una sola chiamata.
+    """
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def validate_vector_store():
     """Valida che il vector store FAISS sia presente e accessibile"""
-    base_dir = pathlib.Path(__file__).parent.parent
-    db_folder = base_dir / "db"
-    
+    db_folder = _DB_FOLDER
+
     if not db_folder.exists():
         print(f"❌ ERRORE: Cartella vector store non trovata: {db_folder}")
         print("Crea la cartella 'db' e vettorizza i documenti PDF prima di procedere")
         return False, None
     
-    faiss_files = list(db_folder.glob("*.faiss"))
-    pkl_files = list(db_folder.glob("*.pkl"))
-    
-    if not faiss_files or not pkl_files:
-        print(f"❌ ERRORE: File FAISS non completi nella cartella {db_folder}")
-        print("File trovati:")
-        print(f"   - File .faiss: {[f.name for f in faiss_files]}")
-        print(f"   - File .pkl: {[f.name for f in pkl_files]}")
-        print("\nEsegui la vettorizzazione dei documenti PDF prima di procedere")
-        return False, None
-    
-    return True, db_folder
+    # Una sola passata scandir per entrambe le estensioni, con uscita
+    # anticipata: basta sapere che i due file esistono, senza materializzare
+    # due liste con due glob separate
+    have_faiss = have_pkl = False
+    with os.scandir(db_folder) as entries:
+        for entry in entries:
+            name = entry.name
+            if not have_faiss and name.endswith('.faiss'):
+                have_faiss = True
+            elif not have_pkl and name.endswith('.pkl'):
+                have_pkl = True
+            if have_faiss and have_pkl:
+                return True, db_folder
+
+    # Solo in caso di errore vale la pena di elencare cosa c'è davvero
+    print(f"❌ ERRORE: File FAISS non completi nella cartella {db_folder}")
+    print("File trovati:")
+    print(f"   - File .faiss: {[f.name for f in db_folder.glob('*.faiss')]}")
+    print(f"   - File .pkl: {[f.name for f in db_folder.glob('*.pkl')]}")
+    print("\nEsegui la vettorizzazione dei documenti PDF prima di procedere")
+    return False, None
 
 def get_business_idea():
     """Ottiene l'idea di business dall'utente con opzione di esempio"""
@@ -84,22 +165,29 @@ def get_business_idea():
     return business_idea
 
 def run_extractor_agent(extractor_agent_instance, reader_agent_instance, filename):
-    """Esegue l'agente Extractor in background con approccio ibrido"""
+    """
+    Esegue l'agente Extractor in background con approccio ibrido.
+
+    Returns:
+        Il dict dei dati estratti (None in caso di errore): il chiamante lo
+        usa direttamente, il JSON su disco resta solo come archivio.
+    """
     print("\n🤖 EXTRACTOR AGENT: Avvio estrazione dati strutturati con approccio ibrido...")
     
     try:
-        # Crea la cartella json_description se non esiste
-        json_dir = pathlib.Path(__file__).parent / "json_description"
-        json_dir.mkdir(exist_ok=True)
-        
+        # Cartella di archivio già creata all'import del modulo
+        json_dir = _JSON_DIR
+
         # Crea il nome del file JSON basato sul nome del bando
         json_filename = filename.replace('.pdf', '.json').replace('.PDF', '.json')
         output_file = json_dir / json_filename
         
-        print(f"📁 Directory output: {json_dir}")
-        print(f"📁 Directory output (PATH ASSOLUTO): {json_dir.absolute()}")
-        print(f"📄 File output: {json_filename}")
-        print(f"📄 File output (PATH COMPLETO): {output_file.absolute()}")
+        _emit(
+            f"📁 Directory output: {json_dir}",
+            f"📁 Directory output (PATH ASSOLUTO): {json_dir.absolute()}",
+            f"📄 File output: {json_filename}",
+            f"📄 File output (PATH COMPLETO): {output_file.absolute()}"
+        )
         
         # Recupera il path completo del file sorgente
         source_file = reader_agent_instance.current_metadata.get('source', '')
@@ -124,42 +212,55 @@ def run_extractor_agent(extractor_agent_instance, reader_agent_instance, filenam
                 if output_file.exists():
                     print(f"⚠️ File esistente verrà sovrascritto: {output_file.name}")
                 
-                # Salva il JSON
+                # Salva il JSON di archivio: serializzazione in un unico
+                # buffer di bytes (orjson se disponibile) e scrittura diretta
+                # con os.write. Niente fsync: i dati viaggiano in memoria verso
+                # il chiamante e le riletture nello stesso processo (writer)
+                # sono servite dalla page cache
                 try:
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump(extracted_data, f, ensure_ascii=False, indent=2)
-                        f.flush()  # Forza la scrittura su disco
-                        os.fsync(f.fileno())  # Assicura che sia scritto fisicamente
+                    buffer = _json_dumps_bytes(extracted_data)
+                    fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                    try:
+                        os.write(fd, buffer)
+                    finally:
+                        os.close(fd)
                 except Exception as e:
                     print(f"\n❌ EXTRACTOR AGENT: Errore durante il salvataggio: {e}")
-                    return
+                    return extracted_data
                 
                 # Verifica che il file sia stato effettivamente scritto
                 if output_file.exists():
                     file_size = output_file.stat().st_size
-                    print(f"\n✅ EXTRACTOR AGENT: Dati salvati in {output_file}")
-                    print(f"📍 PATH COMPLETO: {output_file.absolute()}")
-                    print(f"📊 Dimensione file: {file_size} bytes")
-                    print(f"📊 Anteprima dati estratti:")
-                    print(f"   - Ente: {extracted_data.get('Ente erogatore', 'N/A')}")
-                    print(f"   - Titolo: {extracted_data.get('Titolo dell\'avviso', 'N/A')[:50]}...")
-                    print(f"   - Dotazione: {extracted_data.get('Dotazione finanziaria', 'N/A')}")
-                    print(f"   - Beneficiari: {extracted_data.get('Beneficiari', 'N/A')[:50]}...")
-                    
+                    # variabile di appoggio: un backslash nelle espressioni
+                    # f-string non è valido prima di Python 3.12
+                    titolo_avviso = extracted_data.get("Titolo dell'avviso", 'N/A')
                     # Conta i campi compilati vs non specificati
                     filled_fields = sum(1 for v in extracted_data.values() if v != "Non specificato")
                     total_fields = len(extracted_data)
-                    print(f"   - Completezza: {filled_fields}/{total_fields} campi compilati")
+                    _emit(
+                        f"\n✅ EXTRACTOR AGENT: Dati salvati in {output_file}",
+                        f"📍 PATH COMPLETO: {output_file.absolute()}",
+                        f"📊 Dimensione file: {file_size} bytes",
+                        "📊 Anteprima dati estratti:",
+                        f"   - Ente: {extracted_data.get('Ente erogatore', 'N/A')}",
+                        f"   - Titolo: {titolo_avviso[:50]}...",
+                        f"   - Dotazione: {extracted_data.get('Dotazione finanziaria', 'N/A')}",
+                        f"   - Beneficiari: {extracted_data.get('Beneficiari', 'N/A')[:50]}...",
+                        f"   - Completezza: {filled_fields}/{total_fields} campi compilati"
+                    )
                 else:
                     print(f"\n❌ EXTRACTOR AGENT: Errore - il file non è stato salvato!")
+                return extracted_data
             else:
                 print("\n❌ EXTRACTOR AGENT: Errore nell'estrazione dati")
         else:
             print("\n❌ EXTRACTOR AGENT: Impossibile ricostruire il documento completo")
-            
+
     except Exception as e:
         print(f"\n❌ EXTRACTOR AGENT: Errore: {e}")
 
+    return None
+
 def run_writer_agent(writer_agent_instance, json_dir: pathlib.Path):
     """Esegue il WriterAgent per creare il file Excel"""
     print("\n📝 WRITER AGENT: Avvio creazione report Excel...")
@@ -182,6 +283,135 @@ def run_writer_agent(writer_agent_instance, json_dir: pathlib.Path):
         import traceback
         traceback.print_exc()
 
+def _run_writer_when_ready(writer_agent_instance):
+    """
+    Corpo del task writer accodato dietro l'extractor sullo stesso worker:
+    quando parte, l'archivio JSON è già completo, quindi la creazione
+    dell'Excel si sovrappone al resto della chat invece di accodarsi alla
+    sua fine.
+
+    Returns:
+        True se il report è stato creato, False se non c'era nulla da fare.
+    """
+    json_files = list(_JSON_DIR.glob("*.json"))
+    if not json_files:
+        _emit("⚠️ Nessun file JSON trovato nella directory json_description",
+              "   Il WriterAgent non verrà eseguito")
+        return False
+
+    _emit("\n" + "="*70, "🚀 AVVIO WRITER AGENT", "="*70,
+          f"📊 Trovati {len(json_files)} file JSON da consolidare in Excel")
+    run_writer_agent(writer_agent_instance, _JSON_DIR)
+    return True
+
+
+def run_extractors_batch(extractor_agent_instance, reader_agent_instance,
+                         filenames, max_workers=None):
+    """
+    Estrae i dati strutturati di più bandi in parallelo.
+
+    Le estrazioni sono I/O-bound (chiamate LLM), quindi un pool di thread
+    scala quasi linearmente fino al rate limit Azure: il numero di worker
+    (AZURE_PARALLELISM, default 8) fa da limite naturale alle richieste in
+    volo, senza bisogno di un semaforo separato. Ogni risultato viene
+    archiviato in json_description/ come nel percorso singolo.
+
+    Args:
+        filenames: Lista di nomi file PDF già presenti nel vector store
+        max_workers: Estrazioni concorrenti (default da AZURE_PARALLELISM)
+
+    Returns:
+        dict filename -> dati estratti (None se l'estrazione è fallita)
+    """
+    if max_workers is None:
+        max_workers = int(os.getenv("AZURE_PARALLELISM", "8"))
+    max_workers = min(max_workers, max(len(filenames), 1))
+
+    json_dir = _JSON_DIR
+
+    # Nome file -> path sorgente completo, dall'indice per-source del RAG
+    sources = {pathlib.PurePath(source).name: source
+               for source in reader_agent_instance.rag_system._source_index()}
+
+    def _extract_one(filename):
+        source_file = sources.get(filename, filename)
+        full_document = extractor_agent_instance.reconstruct_full_document(
+            reader_agent_instance.rag_system, source_file)
+        if not full_document:
+            return filename, None
+
+        extracted_data = extractor_agent_instance.extract_structured_info_hybrid(
+            rag_system=reader_agent_instance.rag_system,
+            full_document=full_document,
+            filename=filename,
+            source_file=source_file
+        )
+        if extracted_data:
+            output_file = json_dir / filename.replace('.pdf', '.json').replace('.PDF', '.json')
+            output_file.write_bytes(_json_dumps_bytes(extracted_data))
+        return filename, extracted_data
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_extract_one, filename) for filename in filenames]
+        for future in as_completed(futures):
+            filename, extracted_data = future.result()
+            results[filename] = extracted_data
+            stato = "✅" if extracted_data else "❌"
+            print(f"{stato} Estrazione completata: {filename}")
+
+    return results
+
+
+async def run_many(business_ideas, concurrency=8):
+    """
+    Esegue la pipeline reader -> extractor per più idee di business in parallelo.
+
+    Le idee vengono risolte sul vector store con UNA sola ricerca batched,
+    poi le estrazioni girano concorrenti sotto un semaforo tarato sul rate
+    limit Azure. Gli oggetti costosi (RagSystem, indice FAISS, client LLM)
+    sono singleton di processo, quindi ogni esecuzione paga solo il lavoro
+    della propria idea.
+
+    Args:
+        business_ideas: Lista di idee di business da processare
+        concurrency: Numero massimo di estrazioni in volo
+
+    Returns:
+        dict idea -> dati estratti (None se la pipeline non ha prodotto nulla)
+    """
+    reader_agent_instance = ReaderAgent()
+    extractor_agent_instance = ExtractorAgent()
+
+    # Una sola richiesta embeddings + una sola ricerca FAISS per tutte le idee
+    documents_per_idea = reader_agent_instance.search_batch(list(business_ideas), k=1)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(business_idea, documents):
+        async with semaphore:
+            if not documents:
+                return business_idea, None
+            metadata = getattr(documents[0], 'metadata', {})
+            source_file = metadata.get('source', '')
+            filename = reader_agent_instance.extract_filename_from_metadata(metadata)
+
+            full_document = await asyncio.to_thread(
+                extractor_agent_instance.reconstruct_full_document,
+                reader_agent_instance.rag_system, source_file)
+            if not full_document:
+                return business_idea, None
+
+            extracted_data = await asyncio.to_thread(
+                extractor_agent_instance.extract_structured_info_hybrid,
+                reader_agent_instance.rag_system, full_document, filename, source_file)
+            return business_idea, extracted_data
+
+    results = await asyncio.gather(
+        *(process(idea, documents)
+          for idea, documents in zip(business_ideas, documents_per_idea)))
+    return dict(results)
+
 def interactive_chat_mode(reader_agent_instance):
     """Modalità chat interattiva con l'utente"""
     print("\n" + "="*70)
@@ -190,28 +420,43 @@ def interactive_chat_mode(reader_agent_instance):
     print(f"📄 Documento caricato: {reader_agent_instance.current_filename}")
     print("Puoi fare domande sul bando. Digita 'exit' per uscire o 'reset' per azzerare la conversazione.")
     print("-"*70)
-    
-    while True:
-        user_input = input("\n🤔 La tua domanda: ").strip()
-        
-        if user_input.lower() == 'exit':
-            print("👋 Uscita dalla modalità chat.")
-            break
-        elif user_input.lower() == 'reset':
-            reader_agent_instance.reset_conversation()
-            print("🔄 Conversazione resettata. Puoi ricominciare con nuove domande.")
-            continue
-        elif not user_input:
-            print("⚠️ Inserisci una domanda valida.")
-            continue
-        
-        print("\n⏳ Elaborazione risposta...")
-        response = reader_agent_instance.chat_about_document(user_input)
-        
-        print("\n📢 RISPOSTA:")
-        print("-"*70)
-        print(response)
-        print("-"*70)
+
+    # Il loop alterna attesa dell'utente (secondi di "think time") e attesa
+    # dell'LLM: durante la lettura della risposta un worker in background
+    # tiene calda la connessione verso Azure, così il turno successivo non
+    # ripaga l'handshake TCP/TLS
+    with ThreadPoolExecutor(max_workers=1) as warm_executor:
+        warm_future = None
+
+        while True:
+            user_input = input("\n🤔 La tua domanda: ").strip()
+
+            if user_input.lower() == 'exit':
+                print("👋 Uscita dalla modalità chat.")
+                break
+            elif user_input.lower() == 'reset':
+                reader_agent_instance.reset_conversation()
+                print("🔄 Conversazione resettata. Puoi ricominciare con nuove domande.")
+                continue
+            elif not user_input:
+                print("⚠️ Inserisci una domanda valida.")
+                continue
+
+            # Raccoglie (senza bloccare) l'esito del keep-warm precedente
+            if warm_future is not None:
+                if warm_future.done():
+                    warm_future = None
+
+            print("\n⏳ Elaborazione risposta...")
+            response = reader_agent_instance.chat_about_document(user_input)
+
+            print("\n📢 RISPOSTA:")
+            print("-"*70)
+            print(response)
+            print("-"*70)
+
+            if warm_future is None:
+                warm_future = warm_executor.submit(warm_llm_connection)
 
 def main():
     print("🚀 SISTEMA RAG + CrewAI - Analisi Intelligente Bandi Lombardia")
@@ -224,20 +469,21 @@ def main():
     # Validazione prerequisiti
     print("=== VALIDAZIONE SISTEMA ===")
     
-    if not validate_environment():
+    cfg = get_cfg()
+    if cfg is None:
         return None
     print("✅ Variabili d'ambiente configurate correttamente")
-    
+
     vector_store_valid, db_folder = validate_vector_store()
     if not vector_store_valid:
         return None
     print(f"✅ Vector store trovato in: {db_folder}")
-    
+
     print("\n=== CONFIGURAZIONE AZURE ===")
-    print(f"Endpoint: {os.getenv('AZURE_API_BASE')}")
-    print(f"LLM Model: {os.getenv('AZURE_LLM_MODEL')}")
-    print(f"Embedding Model: {os.getenv('AZURE_EMBEDDING_MODEL')}")
-    print(f"API Version: {os.getenv('AZURE_API_VERSION')}")
+    print(f"Endpoint: {cfg.api_base}")
+    print(f"LLM Model: {cfg.llm_model}")
+    print(f"Embedding Model: {cfg.embedding_model}")
+    print(f"API Version: {cfg.api_version}")
     print()
     
     # Input dell'utente
@@ -279,13 +525,19 @@ def main():
         print(f"📄 Lunghezza documento: {len(document_context)} caratteri")
         print()
         
-        # Avvia l'Extractor Agent in un thread separato
-        extractor_thread = threading.Thread(
-            target=run_extractor_agent,
-            args=(extractor_agent_instance, reader_agent_instance, filename)
+        # Avvia l'Extractor Agent in parallelo alla chat: un Future al posto
+        # del thread manuale, così l'attesa finale è solo il lavoro residuo
+        # e non un join con timeout fissi. Il writer è accodato sullo stesso
+        # worker singolo: parte nell'istante in cui l'extractor finisce,
+        # sovrapponendo la creazione dell'Excel al tempo di lettura
+        # dell'utente invece di aspettare la fine della chat
+        background_executor = ThreadPoolExecutor(max_workers=1)
+        extractor_future = background_executor.submit(
+            run_extractor_agent, extractor_agent_instance, reader_agent_instance, filename
+        )
+        writer_future = background_executor.submit(
+            _run_writer_when_ready, writer_agent_instance
         )
-        extractor_thread.daemon = True
-        extractor_thread.start()
         
         # Mostra info iniziali sul documento
         print("=== INFORMAZIONI INIZIALI SUL BANDO ===")
@@ -296,77 +548,43 @@ def main():
         # Avvia la modalità chat interattiva
         interactive_chat_mode(reader_agent_instance)
         
-        # Attendi che l'extractor finisca (con timeout)
+        # Attendi che l'extractor finisca: di norma ha già terminato durante
+        # la chat, quindi result() ritorna subito e senza timeout arbitrari
         print("\n⏳ Attendo completamento estrazione dati...")
-        extractor_thread.join(timeout=60)  # Aumentato timeout a 60 secondi
-        
-        if extractor_thread.is_alive():
-            print("⚠️ L'estrazione dati sta ancora procedendo in background")
-            print("⏳ Attendo ancora 30 secondi...")
-            extractor_thread.join(timeout=30)
-            
-            if extractor_thread.is_alive():
-                print("❌ Timeout: l'estrazione sta impiegando troppo tempo")
-        else:
+        try:
+            extracted_data = extractor_future.result(timeout=_EXTRACTOR_TIMEOUT_S)
             print("✅ Estrazione dati completata!")
-            
-            # Mostra il JSON salvato se esiste
-            json_dir = pathlib.Path(__file__).parent / "json_description"
-            json_filename = filename.replace('.pdf', '.json').replace('.PDF', '.json')
-            json_path = json_dir / json_filename
-            
-            # Aggiungi un piccolo delay per assicurarsi che il file sia stato scritto
-            import time
-            time.sleep(0.5)
-            
-            if json_path.exists():
-                print(f"\n📊 DATI STRUTTURATI ESTRATTI (salvati in {json_path}):")
-                print(f"📍 PATH ASSOLUTO: {json_path.absolute()}")
-                print(f"📊 Dimensione file: {json_path.stat().st_size} bytes")
+        except FuturesTimeout:
+            extracted_data = None
+            print(f"❌ Estrazione non completata entro {_EXTRACTOR_TIMEOUT_S}s, si prosegue senza")
+        except Exception as e:
+            print(f"❌ Errore durante l'estrazione dati: {e}")
+        else:
+            # Mostra i dati estratti dal dict in memoria: il file JSON resta
+            # come archivio, nessuna rilettura da disco necessaria
+            if extracted_data:
+                json_filename = filename.replace('.pdf', '.json').replace('.PDF', '.json')
+                json_path = _JSON_DIR / json_filename
+
+                print(f"\n📊 DATI STRUTTURATI ESTRATTI (archiviati in {json_path}):")
                 print("-"*70)
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    print(json.dumps(data, ensure_ascii=False, indent=2))
+                # stessa serializzazione dell'archivio (orjson se disponibile)
+                print(_json_dumps_bytes(extracted_data).decode())
                 print("-"*70)
             else:
-                print(f"\n⚠️ File JSON non trovato in: {json_path.absolute()}")
-                print("Possibili cause:")
-                print("1. L'estrazione è ancora in corso")
-                print("2. Si è verificato un errore durante il salvataggio")
-                print("3. Il percorso del file potrebbe essere diverso")
-        
-        # Esegui il WriterAgent dopo che l'ExtractorAgent ha finito
-        print("\n" + "="*70)
-        print("🚀 AVVIO WRITER AGENT")
-        print("="*70)
+                print("\n⚠️ L'estrazione non ha prodotto dati strutturati.")
         
-        json_dir = pathlib.Path(__file__).parent / "json_description"
-        
-        # Verifica che ci siano file JSON da processare
-        json_files = list(json_dir.glob("*.json"))
-        if json_files:
-            print(f"📊 Trovati {len(json_files)} file JSON da consolidare in Excel")
-            
-            # Lancia il WriterAgent in un thread separato
-            writer_thread = threading.Thread(
-                target=run_writer_agent,
-                args=(writer_agent_instance, json_dir)
-            )
-            writer_thread.daemon = True
-            writer_thread.start()
-            
-            # Attendi il completamento con timeout
-            print("⏳ Attendo completamento creazione Excel...")
-            writer_thread.join(timeout=30)
-            
-            if writer_thread.is_alive():
-                print("⚠️ La creazione del report Excel sta ancora procedendo...")
-            else:
+        # Il writer è partito appena l'extractor ha finito (stesso worker
+        # accodato): di norma l'Excel è già pronto e result() ritorna subito
+        print("\n⏳ Attendo completamento report Excel...")
+        try:
+            if writer_future.result(timeout=_WRITER_TIMEOUT_S):
                 print("✅ Processo WriterAgent completato!")
-        else:
-            print("⚠️ Nessun file JSON trovato nella directory json_description")
-            print("   Il WriterAgent non verrà eseguito")
-        
+        except FuturesTimeout:
+            print(f"❌ Report non completato entro {_WRITER_TIMEOUT_S}s")
+        except Exception as e:
+            print(f"❌ Errore durante la creazione del report: {e}")
+
         return True
         
     except Exception as e:
@@ -1,17 +1,177 @@
+import asyncio
+import hashlib
+import math
+import os
+import pathlib
+import pickle
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cached_property, lru_cache, partial
+
+import faiss
+import numpy as np
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import AzureOpenAIEmbeddings
 from langchain_openai import AzureChatOpenAI
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import TextLoader
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from typing_extensions import List, TypedDict
 from langchain_core.documents import Document
 from langchain.prompts import PromptTemplate
 from langchain_core.tools import Tool
 
+from tools.simd_similarity import best_match
+
+#persistent caches are anchored to the package directory, not the process CWD:
+#launching main.py or streamlit from elsewhere must neither cold-start them
+#nor scatter .sqlite3 files into whatever directory the user runs from
+_MODULE_DIR = pathlib.Path(__file__).resolve().parent
+
+#years mentioned in a query or document, used for metadata pre-filtering
+_YEAR_RE = re.compile(r"\b(20\d{2})\b")
+
+#terms indexed for the keyword leg of hybrid retrieval; 4+ letters keeps
+#Italian stopwords (di, che, per, con...) out without a stopword list
+_TERM_RE = re.compile(r"\w{4,}")
+
+@lru_cache(maxsize=None)
+def _get_token_encoder(model_name: str):
+    """
+    Build the tiktoken encoder for a model once per process.
+    Rebuilding the BPE table on every RagSystem instantiation is a non-trivial
+    cost, so the encoder is cached globally and shared across instances.
+    Args:
+        model_name (str): Name of the model whose encoding should be used.
+    Returns:
+        The tiktoken Encoding for the model (cl100k_base as fallback).
+    """
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _make_length_function(embedding_model: str):
+    """
+    Build the chunk-length function for the text splitter: token counting via the
+    cached tiktoken encoder, with character counting as fallback.
+    Args:
+        embedding_model (str): Name of the embedding model used for tokenization.
+    """
+    try:
+        encoder = _get_token_encoder(embedding_model)
+        return lambda text: len(encoder.encode(text))
+    except ImportError:
+        return len
+
+
+def _load_and_split_file(doc_path: str, chunk_size: int, chunk_overlap: int, embedding_model: str) -> List[Document]:
+    """
+    Load one document file and split it into chunks.
+    Module-level (and picklable) so it can run in worker processes: PDF parsing
+    is CPU-bound, so spreading files across a process pool uses all cores.
+    Args:
+        doc_path (str): Path to the document file.
+        chunk_size (int): Splitter chunk size.
+        chunk_overlap (int): Splitter chunk overlap.
+        embedding_model (str): Embedding model name, for token-based length counting.
+    Returns:
+        List[Document]: The split chunks of the file.
+    Errors:
+        ValueError: If the file type is not supported.
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=_make_length_function(embedding_model)
+    )
+
+    if doc_path.endswith('.pdf'):
+        return PyPDFLoader(doc_path).load_and_split(text_splitter=splitter)
+    elif doc_path.endswith('.txt'):
+        #fast path: read the raw text and split it directly, skipping the
+        #TextLoader wrap-then-split round trip and its per-file Document churn
+        text = pathlib.Path(doc_path).read_text(encoding='utf-8')
+        return [
+            Document(page_content=chunk, metadata={'source': doc_path})
+            for chunk in splitter.split_text(text)
+        ]
+    else:
+        raise ValueError("Unsupported file type. Please provide a PDF or TXT file.")
+
+
+class CachedAzureOpenAIEmbeddings(AzureOpenAIEmbeddings):
+    """
+    Azure OpenAI embeddings with a persistent on-disk cache.
+    Each embedded text is keyed by sha256(model + '\\0' + text) in a SQLite table,
+    so re-ingesting unchanged documents costs zero API calls and zero billed tokens:
+    cache hits are resolved with a local lookup instead of a network round trip.
+    """
+
+    cache_path: str = str(_MODULE_DIR / "embedding_cache.sqlite3")
+
+    def _cache_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.cache_path)
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vec BLOB)")
+        return conn
+
+    def _cache_key(self, text: str) -> bytes:
+        return hashlib.sha256((self.model + "\0" + text).encode("utf-8")).digest()
+
+    def _lookup_cached(self, conn: sqlite3.Connection, keys: List[bytes]) -> dict:
+        cached = {}
+        for key in set(keys):
+            row = conn.execute("SELECT vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                cached[key] = np.frombuffer(row[0], dtype=np.float32).tolist()
+        return cached
+
+    def _store_cached(self, conn: sqlite3.Connection, keys: List[bytes], vectors: List[List[float]]):
+        for key, vector in zip(keys, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            conn.execute("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", (key, blob))
+        conn.commit()
+
+    def embed_documents(self, texts: List[str], chunk_size: int | None = None) -> List[List[float]]:
+        keys = [self._cache_key(text) for text in texts]
+        conn = self._cache_connection()
+        try:
+            cached = self._lookup_cached(conn, keys)
+            miss_indices = [i for i, key in enumerate(keys) if key not in cached]
+            if miss_indices:
+                fresh = super().embed_documents([texts[i] for i in miss_indices], chunk_size=chunk_size)
+                self._store_cached(conn, [keys[i] for i in miss_indices], fresh)
+                for i, vector in zip(miss_indices, fresh):
+                    cached[keys[i]] = vector
+            return [cached[key] for key in keys]
+        finally:
+            conn.close()
+
+    async def aembed_documents(self, texts: List[str], chunk_size: int | None = None) -> List[List[float]]:
+        keys = [self._cache_key(text) for text in texts]
+        conn = self._cache_connection()
+        try:
+            cached = self._lookup_cached(conn, keys)
+            miss_indices = [i for i, key in enumerate(keys) if key not in cached]
+            if miss_indices:
+                fresh = await super().aembed_documents([texts[i] for i in miss_indices], chunk_size=chunk_size)
+                self._store_cached(conn, [keys[i] for i in miss_indices], fresh)
+                for i, vector in zip(miss_indices, fresh):
+                    cached[keys[i]] = vector
+            return [cached[key] for key in keys]
+        finally:
+            conn.close()
+
+
 class RagSystem:
 
-    def __init__(self, api_key: str, api_end_point: str, api_version: str, embedding_model: str, llm_model: str):
+    def __init__(self, api_key: str, api_end_point: str, api_version: str, embedding_model: str, llm_model: str,
+                 cache_path: str = str(_MODULE_DIR / "embedding_cache.sqlite3"),
+                 index_type: str = "hnsw"):
         """
         Initialize the RAG system with a document path and Azure OpenAI credentials.
 
@@ -20,13 +180,39 @@ class RagSystem:
             api_version (str): API version for Azure OpenAI.
             embedding_model (str): Name of the Azure OpenAI embedding model to use.
             llm_model (str): Name of the Azure OpenAI LLM model to use.
+            cache_path (str): Path of the SQLite file used to cache document embeddings
+                (defaults inside the package directory, independent of the CWD).
+            index_type (str): FAISS index type, "hnsw" (sub-linear graph search,
+                the default: search cost stays logarithmic as the corpus grows),
+                "flat" (exact brute-force scan), "sq8" (int8-quantized storage,
+                ~4x less memory) or "sq8_refine" (int8 scan plus exact FP32
+                rerank of the top candidates).
         """
+        #FAISS stays single-threaded unless told otherwise: let its OpenMP
+        #kernels use every core (overridable via FAISS_THREADS). SIMD (AVX2)
+        #kernels come from the faiss build itself.
+        faiss.omp_set_num_threads(int(os.getenv("FAISS_THREADS", os.cpu_count() or 1)))
+
+        self.index_type = index_type
         self.vector_store = None
-        self.loader = None
+        self.embedding_model_name = embedding_model
+        self.chunk_size = 1000
+        self.chunk_overlap = 200
+        #number of chunks embedded and indexed at a time during streaming ingestion
+        self.embed_batch_size = 256
+
+        #texts per embeddings HTTP request: 16 is the array cap of ada-002
+        #deployments, newer embedding models accept much larger arrays —
+        #raise AZURE_EMBED_REQUEST_SIZE to cut the number of round trips
+        self.embed_request_size = int(os.getenv("AZURE_EMBED_REQUEST_SIZE", "16"))
+
+        #count chunk lengths in tokens of the embedding model rather than characters,
+        #so chunks never exceed the model's token window and batches stay well-sized;
+        #fall back to character counting if tiktoken is unavailable
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            length_function=_make_length_function(embedding_model)
         )
         self._prompt = PromptTemplate(
             input_variables=["input", "context"],
@@ -61,17 +247,59 @@ class RagSystem:
             """
 
         )
-        print(api_key, api_version, embedding_model, llm_model)
         #initilize the embeddings model
-        self.embeddings = AzureOpenAIEmbeddings(
+        self.embeddings = CachedAzureOpenAIEmbeddings(
             api_key= api_key,
             azure_endpoint = api_end_point,
             api_version=api_version,
-            model=embedding_model
+            model=embedding_model,
+            chunk_size=self.embed_request_size,  # texts per request (see embed_request_size)
+            cache_path=cache_path
         )
 
-        #initialize the llm model
-        self.llm = AzureChatOpenAI(
+        #semantic cache over past (query embedding -> answer) pairs: a near-duplicate
+        #question is answered with a single dot-product lookup instead of a full
+        #retrieval + LLM call. Cached embeddings live in one contiguous (M, d)
+        #float32 matrix so the lookup is a single SIMD sweep (see
+        #tools/simd_similarity); created lazily once the dimension is known.
+        self.semantic_cache_threshold = 0.97
+        self._qcache_matrix = None
+        self._qcache_answers = []
+
+        #retriever tools are stateless per k: build each once and reuse it
+        self._retriever_tools = {}
+
+        #near-duplicate filter for ingestion: chunks whose cosine similarity to
+        #an already-inserted vector reaches this threshold (boilerplate headers,
+        #shared legal text) are skipped instead of inflating the index
+        self.dedup_threshold = 0.99
+        self._dedup_index = None
+
+        #inverted index source -> docstore ids, built lazily and rebuilt only
+        #when the docstore grows; makes per-file lookups O(result) instead of
+        #scanning the whole store
+        self._by_source = None
+        self._by_source_size = 0
+
+        #inverted index year -> FAISS positions, for metadata pre-filtering of
+        #searches; same lazy build/invalidation policy as _by_source
+        self._by_year = None
+        self._by_year_size = 0
+
+        #inverted index term -> FAISS positions, for the keyword leg of the
+        #hybrid retrieval; same lazy build/invalidation policy as _by_source
+        self._by_term = None
+        self._by_term_size = 0
+
+        #memoized query embedding: repeated queries skip the Azure embedding round trip
+        #(tuple because lru_cache requires a hashable return value)
+        self._embed_query_cached = lru_cache(maxsize=1024)(
+            lambda query: tuple(self.embeddings.embed_query(query))
+        )
+
+        #the chat model is only needed by generate(); keep its config here and
+        #build the client lazily so ingestion-only runs skip the setup cost
+        self._llm_kwargs = dict(
             api_key=api_key,
             api_version=api_version,
             azure_endpoint = api_end_point,
@@ -80,64 +308,238 @@ class RagSystem:
             max_tokens=1000
         )
 
-    def _select_loader(self, doc_path: str):
+    @cached_property
+    def llm(self) -> AzureChatOpenAI:
+        """Azure chat model, constructed on first access and reused afterwards."""
+        return AzureChatOpenAI(**self._llm_kwargs)
+
+    def add_data_file(self, doc_path: str):
+        """
+        Load and process a single document file such as pdf or txt, splitting it
+        into chunks and storing embeddings. Uses the same streaming ingest path
+        as add_data_files, whether or not the vector store already exists.
+        Args:
+            doc_path (str): Path to the document file to be processed.
+        """
+        documents = _load_and_split_file(
+            doc_path,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            embedding_model=self.embedding_model_name
+        )
+        print(f"Split {os.path.basename(doc_path)} into {len(documents)} sub-documents.")
+        self._ingest_batch(documents)
+
+    def _build_faiss_index(self, d: int):
         """
-        Select the appropriate document loader based on the file type.
+        Create the raw FAISS index for the configured index_type.
         Args:
-            doc_path (str): Path to the document file.
+            d (int): Dimension of the embedding vectors.
         Returns:
-            Document loader instance for the specified file type.
+            A FAISS index instance.
         Errors:
-            ValueError: If the file type is not supported.
+            ValueError: If index_type is not supported.
         """
-
-        if doc_path.endswith('.pdf'):
-            return PyPDFLoader(doc_path)
-        elif doc_path.endswith('.txt'):
-            return TextLoader(doc_path)
+        if self.index_type == "flat":
+            #inner product over L2-normalized vectors == cosine similarity,
+            #computed with SIMD-friendly IP kernels instead of the L2 expansion
+            return faiss.IndexFlatIP(d)
+        elif self.index_type == "hnsw":
+            #graph-based search: O(log N) traversal instead of a full scan
+            index = faiss.IndexHNSWFlat(d, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = 64
+            return index
+        elif self.index_type == "sq8":
+            #int8 scalar quantization: ~4x less memory and bandwidth per stored
+            #vector, at a 1-3% recall cost; trained on the first ingested batch
+            return faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == "sq8_refine":
+            #int8 coarse scan with SIMD integer kernels, then exact FP32
+            #reranking of the top k*k_factor candidates: recall of the flat
+            #index at close to the scan cost of the quantized one
+            base = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            index = faiss.IndexRefineFlat(base)
+            index.k_factor = 4
+            return index
         else:
-            raise ValueError("Unsupported file type. Please provide a PDF or TXT file.")
-    
-    def _create_vector_store(self, doc_path: str):
-        self.loader = self._select_loader(doc_path)
-        documents = self.loader.load_and_split(text_splitter=self.text_splitter)
-        self.vector_store = FAISS.from_documents(
-            documents=documents,
-            embedding=self.embeddings,
+            raise ValueError(
+                f"Unsupported index_type: {self.index_type}. "
+                "Use 'flat', 'hnsw', 'sq8' or 'sq8_refine'."
+            )
+
+    def _new_vector_store(self, d: int) -> FAISS:
+        """
+        Create an empty LangChain FAISS vector store backed by the configured index type.
+        Vectors are L2-normalized once at insert time so the inner-product index
+        ranks by cosine similarity.
+        Args:
+            d (int): Dimension of the embedding vectors.
+        """
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=self._build_faiss_index(d),
+            docstore=InMemoryDocstore({}),
+            index_to_docstore_id={},
+            normalize_L2=True,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
         )
-        print("Vector store created.")
 
-    def _add_data_file(self,doc_path: str):
+    async def _embed_all(self, texts: List[str], concurrency: int = 20, batch: int = None) -> List[List[float]]:
         """
-        Load and process the document file such as pdf or txt, splitting it into chunks and storing embeddings.
+        Embed a list of texts with concurrent batched requests to Azure OpenAI.
+        The texts are sliced into batches of `batch` elements and up to `concurrency`
+        requests are kept in flight at the same time; embedding is I/O bound so the
+        overlap gives a near-linear speedup up to the endpoint rate limit.
+        Each batch maps to exactly one HTTP request: the chunk_size override below
+        stops langchain from re-splitting it by the client-level default, so the
+        semaphore really governs in-flight requests, not groups of sequential ones.
         Args:
-            doc_path (str): Path to the document file to be processed.
+            texts (List[str]): Texts to embed.
+            concurrency (int): Maximum number of in-flight embedding requests.
+            batch (int): Number of texts per embedding request
+                (default: embed_request_size, see AZURE_EMBED_REQUEST_SIZE).
+        Returns:
+            List[List[float]]: Embedding vectors, in the same order as `texts`.
         """
-        # If vector store already exists, just load the document and split it into chunks
-        self.loader = self._select_loader(doc_path)
-        documents = self.loader.load_and_split(text_splitter=self.text_splitter)
-        print(f"Split blog post into {len(documents)} sub-documents.")              #TODO remove this print statement
+        if batch is None:
+            batch = self.embed_request_size
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def embed_batch(sub_texts):
+            async with semaphore:
+                #retry with exponential backoff to survive transient rate-limit errors
+                for attempt in range(5):
+                    try:
+                        return await self.embeddings.aembed_documents(
+                            sub_texts, chunk_size=len(sub_texts))
+                    except Exception as e:
+                        if attempt == 4:
+                            raise
+                        wait = 2 ** attempt
+                        print(f"Embedding batch failed ({e}), retrying in {wait}s...")
+                        await asyncio.sleep(wait)
+
+        batches = [texts[i:i + batch] for i in range(0, len(texts), batch)]
+        results = await asyncio.gather(*(embed_batch(b) for b in batches))
+        return [vector for sub_result in results for vector in sub_result]
+
+    def _iter_chunks(self, doc_list: List[str]):
+        """
+        Yield split chunks file by file, as a generator.
+        Parsing runs in a process pool while the consumer embeds, so CPU-bound
+        page parsing overlaps with network-bound embedding and at most one
+        file's chunks are resident at a time.
+        Args:
+            doc_list (List[str]): Paths of the document files to load.
+        """
+        load_file = partial(
+            _load_and_split_file,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            embedding_model=self.embedding_model_name
+        )
+        with ProcessPoolExecutor() as executor:
+            for doc_path, documents in zip(doc_list, executor.map(load_file, doc_list)):
+                print(f"Split {os.path.basename(doc_path)} into {len(documents)} sub-documents.")
+                yield from documents
+
+    def _ingest_batch(self, documents: List[Document]):
+        """
+        Embed one batch of chunks and add it to the vector store incrementally.
+        The store is created lazily on the first batch, once the embedding
+        dimension is known.
+        Args:
+            documents (List[Document]): Chunks to embed and index.
+        """
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        embeddings = asyncio.run(self._embed_all(texts))
+
+        normalized = np.asarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(normalized)
 
-        self.vector_store.add_documents(documents)
+        #near-duplicate pass: query the vectors already inserted and drop any
+        #chunk whose top-1 cosine similarity reaches dedup_threshold
+        if self._dedup_index is None:
+            self._dedup_index = faiss.IndexFlatIP(normalized.shape[1])
+        if self._dedup_index.ntotal > 0:
+            scores, _ = self._dedup_index.search(normalized, 1)
+            keep = scores[:, 0] < self.dedup_threshold
+        else:
+            keep = np.ones(len(texts), dtype=bool)
+
+        kept = int(keep.sum())
+        if kept < len(texts):
+            print(f"Deduplication: skipped {len(texts) - kept}/{len(texts)} near-duplicate chunks.")
+        if kept == 0:
+            return
+        self._dedup_index.add(normalized[keep])
+
+        texts = [text for text, flag in zip(texts, keep) if flag]
+        metadatas = [metadata for metadata, flag in zip(metadatas, keep) if flag]
+        embeddings = [embedding for embedding, flag in zip(embeddings, keep) if flag]
+
+        if self.vector_store is None:
+            self.vector_store = self._new_vector_store(len(embeddings[0]))
+            print(f"Vector store created (index type: {self.index_type}).")
+
+        #quantizing index types need a training pass before vectors can be added;
+        #train on (a normalized copy of) the first batch. Flat and HNSW indexes
+        #report is_trained=True, so this is a no-op for them.
+        index = self.vector_store.index
+        if not index.is_trained:
+            index.train(normalized[keep])
 
-    def add_data_files(self, folder_path: List[str]):
+        self.vector_store.add_embeddings(list(zip(texts, embeddings)), metadatas=metadatas)
+
+    def add_data_files(self, folder_path: str, save_path: str = None):
         """
         Load and process multiple document files from a specified folder, splitting them into chunks and storing embeddings.
+        All chunks of the folder are embedded in batched requests (one call per batch of `chunk_size` texts)
+        instead of one request per chunk per file, and the vector store is saved once at the end
+        if a destination is given.
         Args:
-            folder_path (List[str]): List of paths to the document files to be processed.
+            folder_path (str): Path to the folder containing the document files to be processed.
+            save_path (str): Where to save the vector store after ingestion; None skips the
+                save (callers that keep index and documents in separate folders save explicitly).
         """
 
-        #list al documents in the folder
-        doc_list = [ os.path.join(folder_path, f) for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
+        #list the supported documents in the folder; anything else (including a
+        #previously saved index.faiss/index.pkl pair) is skipped instead of
+        #aborting the whole ingestion in _load_and_split_file
+        doc_list = [
+            os.path.join(folder_path, f) for f in os.listdir(folder_path)
+            if os.path.isfile(os.path.join(folder_path, f)) and f.endswith(('.pdf', '.txt'))
+        ]
+
         for doc_path in doc_list:
-            if self.vector_store is None:
-                self._create_vector_store(doc_path)
-            else: 
-                if isinstance(doc_path, str):
-                    self._add_data_file(doc_path)
-                else:
-                    raise ValueError("Each document path must be a string.")
-            rag.save_vector_store(vector_store_path=folder_path)
+            if not isinstance(doc_path, str):
+                raise ValueError("Each document path must be a string.")
+
+        #stream the chunks through bounded batches instead of materializing the
+        #whole folder in memory: only one embedding batch stays resident, so
+        #peak RSS no longer grows with the corpus size
+        batch = []
+        total_chunks = 0
+        for document in self._iter_chunks(doc_list):
+            batch.append(document)
+            if len(batch) >= self.embed_batch_size:
+                self._ingest_batch(batch)
+                total_chunks += len(batch)
+                batch = []
+        if batch:
+            self._ingest_batch(batch)
+            total_chunks += len(batch)
+
+        if total_chunks == 0:
+            print("No documents found to process.")
+            return
+
+        #save once, after the whole folder has been ingested — to the explicit
+        #destination, never into the source folder being listed
+        if save_path is not None:
+            self.save_vector_store(vector_store_path=str(save_path))
 
 
     def save_vector_store(self, vector_store_path: str):
@@ -164,27 +566,122 @@ class RagSystem:
         if self.vector_store is None:
             raise ValueError("Vector store is not initialized. Please add data first.")
         
+        #embed the query through the in-process cache, then search by vector
+        query_vector = list(self._embed_query_cached(query_text))
+
+        #semantic cache lookup: if a past query is close enough, reuse its answer
+        normalized_query = np.asarray([query_vector], dtype=np.float32)
+        faiss.normalize_L2(normalized_query)
+        if self._qcache_matrix is not None and self._qcache_matrix.shape[0] > 0:
+            hit, score = best_match(normalized_query[0], self._qcache_matrix)
+            if score >= self.semantic_cache_threshold:
+                print(f"Semantic cache hit (score {score:.3f}).")
+                return self._qcache_answers[hit]
+
         #build query
         prompt  = self._prompt.invoke({
             "input": query_text,
-            "context": self.vector_store.similarity_search(query_text, k=k)
-        }) 
+            "context": self.vector_store.similarity_search_by_vector(query_vector, k=k)
+        })
 
         # Generate an answer using the LLM
         answer = self.llm.invoke(prompt)
+
+        #insert the new (query embedding, answer) pair into the semantic cache,
+        #keeping the embeddings in one contiguous matrix
+        if self._qcache_matrix is None:
+            self._qcache_matrix = normalized_query
+        else:
+            self._qcache_matrix = np.vstack((self._qcache_matrix, normalized_query))
+        self._qcache_answers.append(answer)
+
         return answer
     def load_vector_store(self, vector_store_path: str):
         """
         Load the vector store from a specified path.
+        The metric flags are passed explicitly because load_local does not
+        persist them: without MAX_INNER_PRODUCT + normalize_L2 a reloaded
+        store would score the IP index with L2 semantics.
         Args:
             vector_store_path (str): Path from where the vector store will be loaded.
         """
         if self.vector_store is None:
-            self.vector_store = FAISS.load_local(vector_store_path, self.embeddings,allow_dangerous_deserialization=True)
+            self.vector_store = FAISS.load_local(
+                vector_store_path,
+                self.embeddings,
+                allow_dangerous_deserialization=True,
+                normalize_L2=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
             print(f"Vector store loaded from {vector_store_path}.")
         else:
             print("Vector store is already initialized.")
     
+    def load_vector_store_mmap(self, vector_store_path: str):
+        """
+        Load the vector store with the FAISS index memory-mapped instead of fully
+        read into RAM: pages fault in on demand and are shared with other
+        processes through the kernel page cache, so cold start is near-instant
+        and resident memory tracks the working set, not the index size.
+        Writes still go through the normal save_vector_store path.
+        Args:
+            vector_store_path (str): Path from where the vector store will be loaded.
+        """
+        if self.vector_store is not None:
+            print("Vector store is already initialized.")
+            return
+
+        folder = pathlib.Path(vector_store_path)
+        index = faiss.read_index(
+            str(folder / "index.faiss"),
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+        with open(folder / "index.pkl", "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+
+        self.vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+            normalize_L2=True,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+        print(f"Vector store loaded (mmap) from {vector_store_path}.")
+
+    def upgrade_index(self, index_type: str = "hnsw", vector_store_path: str = None):
+        """
+        Rebuild the loaded FAISS index as `index_type`, in place.
+        One-shot migration for stores persisted with a brute-force flat index:
+        the stored vectors are reconstructed from the old index, normalized,
+        and re-added to a freshly built index of the requested type (trained
+        first when the type requires it), so similarity_search goes from a
+        full linear scan to the sub-linear search of e.g. HNSW. The docstore
+        and id mapping are untouched.
+        Args:
+            index_type (str): Target index type ('flat', 'hnsw', 'sq8' or 'sq8_refine').
+            vector_store_path (str): If given, the upgraded store is saved there.
+        """
+        if self.vector_store is None:
+            raise ValueError("Vector store is not initialized. Load or build it first.")
+
+        old_index = self.vector_store.index
+        vectors = old_index.reconstruct_n(0, old_index.ntotal)
+        faiss.normalize_L2(vectors)
+
+        self.index_type = index_type
+        new_index = self._build_faiss_index(old_index.d)
+        if not new_index.is_trained:
+            new_index.train(vectors)
+        new_index.add(vectors)
+
+        self.vector_store.index = new_index
+        self.vector_store.distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+        print(f"Index upgraded to '{index_type}' ({old_index.ntotal} vectors).")
+
+        if vector_store_path is not None:
+            self.save_vector_store(vector_store_path)
+
     def get_retriever_tool(self, k: int = 5):
         """        
         Get a retriever tool for querying the vector store.
@@ -195,16 +692,247 @@ class RagSystem:
         """
         if self.vector_store is None:
             raise ValueError("Vector store is not initialized. Please add data first.")
-        else:
-            retriever = self.vector_store.as_retriever(search_type="similarity", search_kwargs={"k": k})
-            tool = Tool(
+        if k not in self._retriever_tools:
+            def retrieve(query: str) -> List[Document]:
+                query_vector = list(self._embed_query_cached(query))
+                return self.vector_store.similarity_search_by_vector(query_vector, k=k)
+
+            self._retriever_tools[k] = Tool(
                 name="retrieve_documents",
-                func=retriever.invoke,
+                func=retrieve,
                 description="Retrieve relevant documents from the vector store based on a query.",
                 return_direct=True
             )
-        return tool
+        return self._retriever_tools[k]
     
+    def batch_retrieve(self, queries: List[str], k: int = 5) -> List[List[Document]]:
+        """
+        Retrieve relevant documents for several queries with one vectorized FAISS search.
+        The queries are embedded in a single batched request, stacked into an
+        (nq, d) matrix and searched in one index call, which FAISS parallelizes
+        internally instead of running one Python call per query.
+        Args:
+            queries (List[str]): The query texts to search for.
+            k (int) = 5: Number of relevant documents to retrieve per query.
+        Returns:
+            List[List[Document]]: Retrieved documents, one list per input query.
+        """
+        if self.vector_store is None:
+            raise ValueError("Vector store is not initialized. Please add data first.")
+
+        #single query: go through the in-process lru_cache, so Streamlit reruns
+        #on the same text skip both the network and the on-disk cache lookup
+        if len(queries) == 1:
+            query_vectors = np.asarray([self._embed_query_cached(queries[0])], dtype=np.float32)
+        else:
+            query_vectors = np.asarray(self.embeddings.embed_documents(list(queries)), dtype=np.float32)
+        faiss.normalize_L2(query_vectors)
+        _, indices = self.vector_store.index.search(query_vectors, k)
+
+        results = []
+        for row in indices:
+            documents = []
+            for index_position in row:
+                if index_position == -1:
+                    continue
+                doc_id = self.vector_store.index_to_docstore_id[int(index_position)]
+                documents.append(self.vector_store.docstore.search(doc_id))
+            results.append(documents)
+        return results
+
+    def _year_index(self) -> dict:
+        """
+        Inverted index year -> FAISS positions of the chunks mentioning that
+        year (in the source file name or in the chunk text). Built lazily in
+        one pass over the docstore and rebuilt only when the docstore grows.
+        Returns:
+            dict: Map year string -> np.ndarray of int64 FAISS positions.
+        """
+        docstore_size = len(self.vector_store.docstore._dict)
+        if self._by_year is None or self._by_year_size != docstore_size:
+            by_year = {}
+            docstore = self.vector_store.docstore._dict
+            for position, doc_id in self.vector_store.index_to_docstore_id.items():
+                doc = docstore.get(doc_id)
+                if doc is None:
+                    continue
+                metadata = getattr(doc, 'metadata', None) or {}
+                haystack = f"{metadata.get('source', '')} {doc.page_content}"
+                for year in set(_YEAR_RE.findall(haystack)):
+                    by_year.setdefault(year, []).append(position)
+            self._by_year = {
+                year: np.asarray(positions, dtype=np.int64)
+                for year, positions in by_year.items()
+            }
+            self._by_year_size = docstore_size
+        return self._by_year
+
+    def prefiltered_search(self, query_text: str, k: int = 5) -> List[Document]:
+        """
+        Similarity search with a metadata pre-filter: years mentioned in the
+        query select the eligible FAISS ids through the inverted year index,
+        and the ANN search only traverses those ids via an IDSelectorArray
+        instead of scanning the whole corpus. Falls back to a full search when
+        the query names no year, the filter selects nothing, or the index type
+        does not support selectors.
+        Args:
+            query_text (str): The query text to search for.
+            k (int) = 5: Number of relevant documents to retrieve.
+        Returns:
+            List[Document]: Retrieved documents, most relevant first.
+        """
+        if self.vector_store is None:
+            raise ValueError("Vector store is not initialized. Please add data first.")
+
+        years = set(_YEAR_RE.findall(query_text))
+        if years:
+            year_index = self._year_index()
+            matches = [year_index[year] for year in years if year in year_index]
+            if matches:
+                allowed = np.unique(np.concatenate(matches))
+                try:
+                    selector = faiss.IDSelectorArray(allowed)
+                    if self.index_type == "hnsw":
+                        params = faiss.SearchParametersHNSW(sel=selector)
+                    else:
+                        params = faiss.SearchParameters(sel=selector)
+
+                    query_vector = np.asarray([self._embed_query_cached(query_text)], dtype=np.float32)
+                    faiss.normalize_L2(query_vector)
+                    _, indices = self.vector_store.index.search(query_vector, min(k, len(allowed)), params=params)
+
+                    documents = []
+                    for index_position in indices[0]:
+                        if index_position == -1:
+                            continue
+                        doc_id = self.vector_store.index_to_docstore_id[int(index_position)]
+                        documents.append(self.vector_store.docstore.search(doc_id))
+                    if documents:
+                        return documents
+                except Exception as e:
+                    print(f"⚠️ Pre-filtered search failed ({e}), falling back to full search.")
+
+        return self.vector_store.similarity_search(query_text, k=k)
+
+    def _term_index(self) -> dict:
+        """
+        Inverted index term -> FAISS positions of the chunks containing that
+        term. Built lazily in one pass over the docstore and rebuilt only when
+        the docstore grows.
+        Returns:
+            dict: Map lowercased term -> list of int FAISS positions.
+        """
+        docstore_size = len(self.vector_store.docstore._dict)
+        if self._by_term is None or self._by_term_size != docstore_size:
+            by_term = {}
+            docstore = self.vector_store.docstore._dict
+            for position, doc_id in self.vector_store.index_to_docstore_id.items():
+                doc = docstore.get(doc_id)
+                if doc is None:
+                    continue
+                for term in set(_TERM_RE.findall(doc.page_content.lower())):
+                    by_term.setdefault(term, []).append(position)
+            self._by_term = by_term
+            self._by_term_size = docstore_size
+        return self._by_term
+
+    def keyword_retrieve(self, query_text: str, k: int = 5) -> List[Document]:
+        """
+        Pure keyword retrieval on the inverted term index: each chunk scores
+        the sum of idf weights of the query terms it contains, so rare legal
+        or sector terms dominate generic ones. Entirely local, no API calls.
+        Args:
+            query_text (str): The query text to search for.
+            k (int) = 5: Number of documents to retrieve.
+        Returns:
+            List[Document]: Retrieved documents, best keyword match first.
+        """
+        if self.vector_store is None:
+            raise ValueError("Vector store is not initialized. Please add data first.")
+
+        term_index = self._term_index()
+        total = max(len(self.vector_store.index_to_docstore_id), 1)
+        scores = {}
+        for term in set(_TERM_RE.findall(query_text.lower())):
+            positions = term_index.get(term)
+            if not positions:
+                continue
+            weight = math.log(1 + total / len(positions))
+            for position in positions:
+                scores[position] = scores.get(position, 0.0) + weight
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[position])
+            for position, _ in top
+        ]
+
+    def hybrid_retrieve(self, query_text: str, k: int = 5) -> List[Document]:
+        """
+        Hybrid retrieval: the dense FAISS search and the keyword search run in
+        parallel (the dense leg waits on Azure for the query embedding, so the
+        keyword scoring overlaps with that round trip) and the two rankings
+        are fused with reciprocal-rank fusion, score = sum(1 / (60 + rank)).
+        RRF is robust to the incomparable score scales of the two retrievers.
+        Args:
+            query_text (str): The query text to search for.
+            k (int) = 5: Number of documents to return after fusion.
+        Returns:
+            List[Document]: Fused ranking, best first.
+        """
+        if self.vector_store is None:
+            raise ValueError("Vector store is not initialized. Please add data first.")
+
+        pool_size = max(k, 10)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            dense_future = executor.submit(self.batch_retrieve, [query_text], pool_size)
+            keyword_documents = self.keyword_retrieve(query_text, k=pool_size)
+            dense_documents = dense_future.result()[0]
+
+        fused = {}
+        for documents in (dense_documents, keyword_documents):
+            for rank, doc in enumerate(documents):
+                entry = fused.setdefault(doc.page_content, [0.0, doc])
+                entry[0] += 1.0 / (60 + rank)
+
+        ordered = sorted(fused.values(), key=lambda entry: entry[0], reverse=True)
+        return [doc for _, doc in ordered[:k]]
+
+    def get_batch_retriever_tool(self, k: int = 5):
+        """
+        Get a retriever tool that accepts a list of queries and searches them in one batch.
+        Args:
+            k (int): Number of relevant documents to retrieve per query.
+        Returns:
+            A retriever tool for batched queries.
+        """
+        if self.vector_store is None:
+            raise ValueError("Vector store is not initialized. Please add data first.")
+        return Tool(
+            name="retrieve_documents_batch",
+            func=lambda queries: self.batch_retrieve(queries, k=k),
+            description="Retrieve relevant documents for a list of queries in a single batched search.",
+            return_direct=True
+        )
+
+    def _source_index(self) -> dict:
+        """
+        Indice inverso source -> lista di id del docstore.
+        Costruito una volta sola e ricostruito solo quando il docstore cresce,
+        così i lookup per file sorgente non scandiscono l'intero store.
+        Returns:
+            dict: Mappa source -> [doc_id, ...].
+        """
+        docstore_size = len(self.vector_store.docstore._dict)
+        if self._by_source is None or self._by_source_size != docstore_size:
+            by_source = {}
+            for doc_id, doc in self.vector_store.docstore._dict.items():
+                metadata = getattr(doc, 'metadata', None) or {}
+                by_source.setdefault(metadata.get('source'), []).append(doc_id)
+            self._by_source = by_source
+            self._by_source_size = docstore_size
+        return self._by_source
+
     def get_all_documents_by_source(self, source_file: str) -> List[Document]:
         """
         Recupera TUTTI i documenti (chunks) da un file sorgente specifico
@@ -218,18 +946,17 @@ class RagSystem:
         """
         if self.vector_store is None:
             raise ValueError("Vector store is not initialized.")
-        
+
         matching_documents = []
-        
+
         try:
             # Accedi al docstore interno di FAISS
             # FAISS LangChain memorizza i documenti in docstore.dict
             if hasattr(self.vector_store, 'docstore'):
-                # Itera su tutti i documenti nel docstore
-                for doc_id, doc in self.vector_store.docstore._dict.items():
-                    # Controlla se il documento appartiene al file sorgente
-                    if hasattr(doc, 'metadata') and doc.metadata.get('source') == source_file:
-                        matching_documents.append(doc)
+                # Lookup diretto nell'indice inverso source -> ids: O(risultato)
+                # invece di iterare l'intero docstore ad ogni chiamata
+                doc_ids = self._source_index().get(source_file, [])
+                matching_documents = [self.vector_store.docstore._dict[doc_id] for doc_id in doc_ids]
             else:
                 # Fallback: se docstore non è accessibile, usa ricerca con k molto alto
                 print("⚠️ Docstore non accessibile, usando fallback con k=5000")
@@ -278,7 +1005,7 @@ if __name__ == "__main__":
         # Add a document file to the RAG system
         # Get the absolute path to the "db" folder under "src"
 
-        rag.add_data_files(folder_path=db_folder)
+        rag.add_data_files(folder_path=db_folder, save_path=db_folder)
 
     else: 
         print("Vector store is already initialized.")
@@ -0,0 +1,34 @@
+# tools/migrate_index.py
+"""
+One-shot migration of a persisted FAISS store to a faster index type.
+
+Stores built with the LangChain default (brute-force flat index) scan every
+chunk on each similarity_search. This script loads the store from db/,
+rebuilds the index as HNSW (or any type supported by RagSystem) and saves it
+back in place. Run once, from src/pj_bandi_regione_lombardia:
+
+    python -m tools.migrate_index [db_path] [index_type]
+"""
+import os
+import pathlib
+import sys
+
+from dotenv import load_dotenv
+
+from rag import RagSystem
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else str(pathlib.Path(__file__).parent.parent.parent / "db")
+    index_type = sys.argv[2] if len(sys.argv) > 2 else "hnsw"
+
+    rag = RagSystem(
+        api_key=os.getenv("AZURE_API_KEY"),
+        api_end_point=os.getenv("AZURE_API_BASE"),
+        api_version=os.getenv("AZURE_API_VERSION"),
+        embedding_model=os.getenv("AZURE_EMBEDDING_MODEL"),
+        llm_model=os.getenv("AZURE_LLM_MODEL")
+    )
+    rag.load_vector_store(vector_store_path=db_path)
+    rag.upgrade_index(index_type=index_type, vector_store_path=db_path)
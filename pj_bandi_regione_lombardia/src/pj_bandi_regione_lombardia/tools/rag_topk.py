@@ -0,0 +1,62 @@
+# tools/rag_topk.py
+"""
+Fast top-k selection over a contiguous float32 score array.
+
+Meant for custom reranking paths layered on top of the FAISS results
+(e.g. BM25-style rescoring after similarity_search), where a Python-level
+heap over per-document scores becomes the hotspot. The kernel is compiled
+with numba when available; otherwise it falls back to numpy argpartition,
+which is still vastly faster than a pure-Python loop.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+
+def _topk_numpy(scores: np.ndarray, k: int) -> np.ndarray:
+    #partial sort: O(n) partition followed by an O(k log k) ordering of the top block
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+if _HAS_NUMBA:
+
+    @njit(cache=True, fastmath=True)
+    def _topk_numba(scores, k):
+        #branch-light partial selection without Python object overhead
+        n = scores.shape[0]
+        indices = np.empty(k, dtype=np.int64)
+        values = np.full(k, -np.inf, dtype=np.float32)
+        for i in range(n):
+            score = scores[i]
+            if score > values[k - 1]:
+                #insert into the sorted top-k buffer
+                j = k - 1
+                while j > 0 and values[j - 1] < score:
+                    values[j] = values[j - 1]
+                    indices[j] = indices[j - 1]
+                    j -= 1
+                values[j] = score
+                indices[j] = i
+        return indices
+
+
+def top_k_indices(scores, k: int) -> np.ndarray:
+    """
+    Return the indices of the k highest scores, best first.
+    Args:
+        scores: Array-like of relevance scores (coerced to contiguous float32).
+        k (int): Number of results to keep.
+    Returns:
+        np.ndarray: Indices of the top-k scores in descending score order.
+    """
+    scores = np.ascontiguousarray(scores, dtype=np.float32)
+    if k >= scores.shape[0]:
+        return np.argsort(scores)[::-1]
+    if _HAS_NUMBA:
+        return _topk_numba(scores, k)
+    return _topk_numpy(scores, k)
@@ -0,0 +1,38 @@
+# tools/simd_similarity.py
+"""
+SIMD cosine similarity for small in-process candidate matrices.
+
+Used for similarity computed outside the FAISS index — e.g. the semantic
+answer cache, where a single query is compared against the (M, d) matrix of
+cached query embeddings. With simsimd installed the sweep runs on
+AVX-512/NEON kernels; otherwise it falls back to a numpy matrix-vector
+product, which is still one BLAS call instead of a Python loop.
+Vectors are expected L2-normalized, so cosine similarity == dot product.
+"""
+import numpy as np
+
+try:
+    import simsimd
+    _HAS_SIMSIMD = True
+except ImportError:
+    _HAS_SIMSIMD = False
+
+
+def best_match(query: np.ndarray, matrix: np.ndarray):
+    """
+    Find the row of `matrix` most similar to `query`.
+    Args:
+        query: L2-normalized query vector, shape (d,).
+        matrix: Contiguous float32 matrix of L2-normalized rows, shape (M, d).
+    Returns:
+        tuple: (row index of the best match, its cosine similarity).
+    """
+    query = np.ascontiguousarray(query, dtype=np.float32).reshape(-1)
+    if _HAS_SIMSIMD:
+        #cdist returns cosine distance (1 - cos) in one SIMD sweep
+        distances = np.asarray(simsimd.cdist(query.reshape(1, -1), matrix, metric="cosine"))[0]
+        best = int(np.argmin(distances))
+        return best, 1.0 - float(distances[best])
+    scores = matrix @ query
+    best = int(np.argmax(scores))
+    return best, float(scores[best])